@@ -1,18 +1,38 @@
 #!/usr/bin/env python
 
-from PIL import Image
 from enum import Enum
 import numpy as np
 import json
+import zlib
+import hashlib
+import struct
 import random
 import copy
-import matplotlib.pyplot as plt
+import heapq
+import itertools
+import contextlib
+from collections import OrderedDict
 import sys
+import os
+import time
 import argparse
-import skimage
+# PIL, matplotlib and the process pool get imported where they're used, so making
+# maps only needs numpy, and the short lived workers start up quick
 
 DEBUG_RUN_TESTS = False
 DEBUG_PLOTS = False
+TILE_CACHE_BYTES = 256 * 1024 * 1024 # default memory bound for decoded tile images, atlases included
+COMPILED_TILESET_MAGIC = b"CIVTILES"
+COMPILED_TILESET_VERSION = 1
+COMPILED_TILESET_ALIGN = 4096 # the atlas starts on a page boundary, so it maps cleanly
+SOLVER_MAX_BACKTRACKS = 10000 # give up on a layout after this many undone decisions
+STRIP_SEAM_ROWS = 3 # rows either side of a seam that get matched again, when making a map in strips
+REROLL_TRIES = 20 # fresh vertex layouts a re-rolled region gets before giving up on fitting it in
+MAP_FILE_VERSION = 1
+PYRAMID_MIN_PX = 8 # stop halving the tile atlas once tiles would get smaller than this
+SCALED_ATLAS_SIZES = 8 # how many odd sized (off pyramid) atlases a TileSet keeps around
+SEARCH_BATCH = 1024 # vertex grids scored per connected component labelling pass
+SAMPLER_TRIES = 8 # alias table draws a propagating decision makes before scanning its cell's domain instead
 
 # ================================================================================= #
 #                    _____                _____            
@@ -57,6 +77,50 @@ def expand_to_8bit(mask4b):
         expnded += "11" if ( mask4b >> ii & 0b1 ) else "00"
     return int(expnded,2)
 
+def shrink_to_4bit(mask8b):
+    # 'or' each pair of bits together, so each side of a border mask becomes one bit
+    acc = 0
+    for n in range(0,4):
+        acc |= ( ( mask8b >> 2*n ) & 0b1 | ( mask8b >> (2*n + 1) ) & 0b1 ) << n
+    return acc
+
+def side_to_border_bits(mask4b):
+    # the inverse of shrink_to_4bit: each side bit selects its pair of border bits
+    acc = 0
+    for n in range(0,4):
+        acc |= 0b11 << 2*n if ( mask4b >> n ) & 0b1 else 0
+    return acc
+
+def parse_mask(string):
+    # a mask as the tile records write it, least significant bit on the left
+    return int(string[::-1], 2)
+
+def mask_string(mask, nbits):
+    # the inverse of parse_mask
+    return format(mask, f"0{nbits}b")[::-1]
+
+def swap_border_pair(pair):
+    # a side's border pair reads backwards from the tile across the edge
+    return ( pair >> 1 ) | ( pair & 1 ) << 1
+
+def rotate_edge_bits(mask4b, turns):
+    # a 4 bit per side mask (edge mask, ignore flags) of a tile turned clockwise `turns` quarter turns:
+    # whatever was on the top ends up on the right, and so on
+    turns %= 4
+    return ( ( mask4b << turns ) | ( mask4b >> (4 - turns) ) ) & 0b1111
+
+def rotate_border_bits(mask8b, turns):
+    # likewise for the 2 bits per side border mask; each side's pair turns with it unchanged
+    turns %= 4
+    return ( ( mask8b << 2*turns ) | ( mask8b >> (8 - 2*turns) ) ) & 0b11111111
+
+# these get hammered once per map cell, so just look them up
+EXPAND_TO_8BIT = tuple(expand_to_8bit(m) for m in range(16))
+SHRINK_TO_4BIT = tuple(shrink_to_4bit(m) for m in range(256))
+SIDE_TO_BORDER_BITS = tuple(side_to_border_bits(m) for m in range(16))
+EXPAND_TO_8BIT_NP = np.array(EXPAND_TO_8BIT, dtype=np.uint8)
+SHRINK_TO_4BIT_NP = np.array(SHRINK_TO_4BIT, dtype=np.uint8)
+
 # ================================================================================= #
 #                             _____ _ _           
 #                            |_   _(_) | ___  ___ 
@@ -71,42 +135,46 @@ class TileRotation(Enum):
     CCW = 3
     TURN180 = 4
 
+# clockwise quarter turns for each rotation, in the order tools/rotate_tiles.py writes them out
+ROTATION_TURNS = {TileRotation.NONE: 0, TileRotation.CW: 1, TileRotation.CCW: 3, TileRotation.TURN180: 2}
+TURNS_ROTATION = {turns: rotation for rotation, turns in ROTATION_TURNS.items()}
+ALL_ROTATIONS = (TileRotation.CW, TileRotation.CCW, TileRotation.TURN180)
+
+def rotate_pixels(pixels, rotation: TileRotation):
+    # a view of pixels (h, w, ...) turned like rotate_edge_bits; np.rot90 turns counter clockwise
+    return np.rot90(pixels, -ROTATION_TURNS[rotation])
+
 class TileSide(Enum):
     TOP = 1
     RHT = 2
     BOT = 3
     LFT = 4
 
-class TileVertex:
-    def __init__(self, pt, edge_id_mask):
-        self.pt = pt
-        self.eid = edge_id_mask
-
-class TileEdge:
-    def __init__(self, vert1: TileVertex, vert2: TileVertex):
-        self.verts = (vert1, vert2)
-        self.eid = self.determine_edge_mask()
-        self.border_mask = None
-        self.sflgs = None
-
-    def determine_edge_mask(self):
-        # if they are both land, then this is a land edge
-        if all([v.eid == 1 for v in self.verts]):
-            return 1
-        # ocean otherwise
-        return 0
-
-    def contains(self, pt1, pt2):
-        v1 = self.verts[0]
-        v2 = self.verts[1]
-        return ( v1.pt == pt1 and v2.pt == pt2 ) or ( v1.pt == pt2 and v2.pt == pt1)
-
 class TileElement:
-    def __init__(self, border_point_mask, edge_id_mask, special_flags, imgfile: str):
+    __slots__ = ("border_point_mask", "edge_id_mask", "special_flags", "imgfile", "rotation", "weight", "count", "piece")
+
+    def __init__(self, border_point_mask, edge_id_mask, special_flags, imgfile: str, rotation=TileRotation.NONE,
+                 weight=1.0, count=None, piece=None):
         self.border_point_mask = border_point_mask
         self.edge_id_mask = edge_id_mask
         self.special_flags = special_flags
         self.imgfile = imgfile
+        self.rotation = rotation # how imgfile is turned to make this tile
+        self.weight = weight # relative odds of being picked over the other candidates for a cell
+        self.count = count # physical copies of the piece in the box, None for no limit
+        self.piece = piece if piece is not None else imgfile # the physical tile this is a side of, count is shared by its turns
+
+    def rotated(self, rotation: TileRotation):
+        '''
+        This tile turned by rotation, masks and all, sharing the same image file
+        '''
+        turns = ROTATION_TURNS[rotation]
+        return TileElement(border_point_mask=rotate_border_bits(self.border_point_mask, turns),
+                           edge_id_mask=rotate_edge_bits(self.edge_id_mask, turns),
+                           special_flags=rotate_edge_bits(self.special_flags, turns),
+                           imgfile=self.imgfile,
+                           rotation=TURNS_ROTATION[(ROTATION_TURNS[self.rotation] + turns) % 4],
+                           weight=self.weight, count=self.count, piece=self.piece)
 
     def edge_id(self, side: TileSide):
         if side == TileSide.TOP:
@@ -132,16 +200,8 @@ class TileElement:
         # edgemask removes ALL constraints on this edge
         # edges must ALWAYS match, unless masked out
         # borders are a bit harder, as we sometimes want to ignore this
-        other_border_ignore_mask = (other.special_flags ^ 0b1111) & 0b1111
-        self_border_ignore_mask = (self.special_flags ^ 0b1111) & 0b1111
-        border_ignore_mask = self_border_ignore_mask & other_border_ignore_mask
-        def shrink(mask8b):
-            # 'or' each pair of bits together
-            acc = 0
-            for n in range(0,4):
-                acc |= ( ( mask8b >> 2*n ) & 0b1 | ( mask8b >> (2*n + 1) ) & 0b1 ) << n
-            return acc
-        border_match = shrink(self.border_point_mask ^ other.border_point_mask) & border_ignore_mask 
+        border_ignore_mask = ~(self.special_flags | other.special_flags) & 0b1111
+        border_match = SHRINK_TO_4BIT[self.border_point_mask ^ other.border_point_mask] & border_ignore_mask 
         edge_match = self.edge_id_mask ^ other.edge_id_mask
         return (border_match | edge_match) & edgemask == 0
 
@@ -155,22 +215,20 @@ class TileElement:
         if side == TileSide.LFT:
             return (self.special_flags >> 3) & 1
 
-    def render(self):
+    def render(self, directory=""):
+        # imgfile is relative to directory, the tile set's TileSet.tile_directory
         if self.imgfile is not None:
-            return np.asarray(Image.open(self.imgfile))
+            from PIL import Image
+            return np.asarray(Image.open(os.path.join(directory, self.imgfile)))
         else:
             return np.zeros((1,1,3), dtype=np.uint8)
 
 def print_tile(tile: TileElement, mask, figid=1):
-    def to_string(value, n):
-        result = ""
-        for i in range(0, n):
-            result += "1" if (value >> i)& 0b1 == 1 else "0"
-        return result # lsb is on the left
+    import matplotlib.pyplot as plt
 
-    brd = to_string(tile.border_point_mask, 8)
-    edge = to_string(tile.edge_id_mask, 4)
-    sflg = to_string(tile.special_flags, 4)
+    brd = mask_string(tile.border_point_mask, 8)
+    edge = mask_string(tile.edge_id_mask, 4)
+    sflg = mask_string(tile.special_flags, 4)
 
     plt.figure(figid)
     plt.subplot(2,2,1)
@@ -210,63 +268,659 @@ def print_tile(tile: TileElement, mask, figid=1):
     plt.title('ignore border constraint')
 
 
+def halve_tiles(tiles):
+    '''
+    (n, h, w, c) stack of tiles -> (n, ceil(h/2), ceil(w/2), c), each output pixel the
+    mean of the 2x2 block under it
+    '''
+    from PIL import Image
+    return np.stack([np.asarray(Image.fromarray(np.asarray(tile)).reduce(2)) for tile in tiles])
+
+def resize_tiles(tiles, tile_wh):
+    '''
+    (n, h, w, c) stack of tiles -> (n, height, width, c) for tile_wh = (width, height)
+    '''
+    from PIL import Image
+    width, height = tile_wh
+    out = np.empty((tiles.shape[0], height, width, tiles.shape[3]), dtype=tiles.dtype)
+    for idx in range(0, tiles.shape[0]):
+        out[idx] = np.asarray(Image.fromarray(np.asarray(tiles[idx])).resize((width, height), Image.Resampling.LANCZOS))
+    return out
+
+class TileImageCache:
+    '''
+    LRU of decoded, already resized tile images, bounded by the bytes it holds.
+    Anything handed out is read-only, since it's shared by every cell using that tile.
+    '''
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        pixels = self._entries.get(key)
+        if pixels is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return pixels
+
+    def put(self, key, pixels):
+        pixels.flags.writeable = False
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+        self._entries[key] = pixels
+        self.nbytes += pixels.nbytes
+        # always keep the newest entry, even if it alone blows the budget
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
 class TileSet:
-    def __init__(self, my_json_file):
-        self.tile_width, self.tile_height = self._parse_tile_width_height(my_json_file)
+    '''
+    my_json_file : a tile set .json, or a tile set compiled from one by TileSet.compile
+    cache_bytes : memory bound for the decoded tile images kept between calls: the per-tile
+        cache, and the atlases of tile_atlas() (the full size one, its pyramid and up to
+        SCALED_ATLAS_SIZES resized ones, turned tiles included).  Once the full atlas is
+        built, tiles are served out of it and the per-tile cache is emptied.  Atlases over
+        the bound are let go of, cheapest to make again first, see atlas_nbytes().  A
+        compiled tile set's full atlas is mapped from its file, and doesn't count
+    rotations : also make every tile turned CW, CCW and 180, see add_rotations().
+        For the unique tile sets, rather than the "modded" ones tools/rotate_tiles.py
+        writes out.  A compiled tile set already has whatever rotations it was compiled with.
+
+    Besides its masks and file, a tile_list record may give
+      "weight" : relative odds of the tile being picked among a cell's candidates, default 1
+      "count"  : copies of the physical tile in the box; maps never use more.  Default no limit
+      "piece"  : which physical tile the record is a side of, default its file.  Records
+                 sharing a piece share its count, as turned copies of a tile do
+    A tile set with any of these is_weighted(), and MapMaker picks tiles with a TileSampler.
+    '''
+    def __init__(self, my_json_file, cache_bytes=TILE_CACHE_BYTES, rotations=False):
+        self.json_file = my_json_file
         self.tile_dtype = np.uint8
         self.tile_channels = 3
-        self.tiles = self._parse_tiles(my_json_file) # a list of TileElement
+        self._image_cache = TileImageCache(cache_bytes)
+        self.index_misses = 0 # find_* queries that had to scan the tile set
+        self.tile_directory = os.path.dirname(my_json_file) # where the tile image files are
+        if TileSet.is_compiled(my_json_file):
+            self._load_compiled(my_json_file)
+            return
+        with open(my_json_file, 'r') as fid:
+            obj = json.load(fid)
+        self.tile_directory = TileSet.tile_directory_of(my_json_file, obj)
+        self.tile_width, self.tile_height = self._parse_tile_width_height(obj)
+        self.tiles = self._parse_tiles(obj) # a list of TileElement
+        if rotations:
+            self.tiles = self.tiles + self.add_rotations(self.tiles)
+        self._reset_tile_tables()
+
+    @staticmethod
+    def add_rotations(tiles):
+        '''
+        The CW, CCW and 180 turned copies of tiles, in the same order tools/rotate_tiles.py
+        writes them out, so a set made this way matches its "modded" .json tile for tile.
+        All ocean tiles are left out, they don't look as good turned.  The copies share
+        their base tile's image, decoded once and turned as a view.
+        '''
+        return [tile.rotated(rotation) for tile in tiles if tile.edge_id_mask != 0 for rotation in ALL_ROTATIONS]
 
     def init_copy_with_new_tiles(self, new_tiles):
         result = copy.deepcopy(self)
         result.tiles = new_tiles
+        result._reset_tile_tables()
         return result
 
+    def __getstate__(self):
+        # copies (deepcopy, or pickled over to a worker process) take the tiles and lookup
+        # tables but none of the decoded pixels; a compiled tile set's atlas gets mapped again
+        state = self.__dict__.copy()
+        state["_image_cache"] = TileImageCache(self._image_cache.max_bytes)
+        state["_atlas"] = None
+        state["_pyramid"] = None
+        state["_scaled_atlases"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._compiled is not None:
+            self._atlas = self._map_compiled()
+
+    '''
+    Compiled tile sets: everything a worker needs in one file, so start up is a header
+    parse and a memory map instead of a JSON parse plus a PNG decode per tile.
+
+        magic (8 bytes) | version (u32) | header length (u32) | JSON header | pad | atlas
+
+    The header holds the tile size and every tile's masks and source file; the atlas
+    is the raw tile_atlas() array, page aligned.  Processes mapping the same file
+    share its pages through the OS page cache.
+    '''
+    @staticmethod
+    def is_compiled(filename):
+        with open(filename, 'rb') as fid:
+            return fid.read(len(COMPILED_TILESET_MAGIC)) == COMPILED_TILESET_MAGIC
+
+    def compile(self, filename):
+        atlas = self.tile_atlas()
+        header = {
+            "tile_width": self.tile_width,
+            "tile_height": self.tile_height,
+            "tile_channels": self.tile_channels,
+            "dtype": np.dtype(self.tile_dtype).str,
+            "atlas_shape": list(atlas.shape),
+            "tiles": [{"file": t.imgfile, "bordermask": t.border_point_mask, "edgemask": t.edge_id_mask, "sflg": t.special_flags,
+                       "rotation": t.rotation.name, "weight": t.weight, "count": t.count, "piece": t.piece} for t in self.tiles],
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+        preamble = len(COMPILED_TILESET_MAGIC) + 8 + len(header_bytes)
+        padding = -preamble % COMPILED_TILESET_ALIGN
+        with open(filename, 'wb') as fid:
+            fid.write(COMPILED_TILESET_MAGIC)
+            fid.write(struct.pack("<II", COMPILED_TILESET_VERSION, len(header_bytes)))
+            fid.write(header_bytes)
+            fid.write(b"\0" * padding)
+            fid.write(np.ascontiguousarray(atlas).tobytes())
+        return filename
+
+    def _load_compiled(self, filename):
+        with open(filename, 'rb') as fid:
+            fid.read(len(COMPILED_TILESET_MAGIC))
+            version, header_len = struct.unpack("<II", fid.read(8))
+            assert(version == COMPILED_TILESET_VERSION)
+            header = json.loads(fid.read(header_len).decode("utf-8"))
+        preamble = len(COMPILED_TILESET_MAGIC) + 8 + header_len
+        offset = preamble + (-preamble % COMPILED_TILESET_ALIGN)
+        self.tile_width = header["tile_width"]
+        self.tile_height = header["tile_height"]
+        self.tile_channels = header["tile_channels"]
+        self.tile_dtype = np.dtype(header["dtype"]).type
+        self.tiles = [TileElement(border_point_mask=t["bordermask"], edge_id_mask=t["edgemask"], special_flags=t["sflg"], imgfile=t["file"],
+                                  rotation=TileRotation[t.get("rotation", "NONE")], weight=t.get("weight", 1.0), count=t.get("count"),
+                                  piece=t.get("piece")) for t in header["tiles"]]
+        self._reset_tile_tables()
+        self._compiled = (filename, header["dtype"], offset, tuple(header["atlas_shape"]))
+        self._atlas = self._map_compiled()
+
+    def _map_compiled(self):
+        filename, dtype, offset, shape = self._compiled
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def _reset_tile_tables(self):
+        # everything derived from self.tiles, rebuilt whenever the tiles change
+        # the masks, as parallel arrays over self.tiles, for the vectorized matching
+        self.border_point_masks = np.array([t.border_point_mask for t in self.tiles], dtype=np.uint8)
+        self.edge_id_masks = np.array([t.edge_id_mask for t in self.tiles], dtype=np.uint8)
+        self.special_flags = np.array([t.special_flags for t in self.tiles], dtype=np.uint8)
+        self._index = {} # constraint key -> list of matching TileElement
+        self._atlas = None # see tile_atlas()
+        self._compiled = None # where the atlas is mapped from, for a compiled tile set
+        self._pyramid = None # halved copies of the atlas, see tile_atlas()
+        self._scaled_atlases = OrderedDict() # (width, height) -> atlas, for sizes between pyramid levels
+        self._tile_indices = None # TileElement -> position in self.tiles
+        self._solver_tables = None # see solver_tables()
+        self._inventory = None # see inventory()
+
+    def match_mask(self, edge_id_masks, border_point_masks, special_flags, select_mask = int("1111", 2)):
+        '''
+        Vectorized TileElement.ismatching of a batch of k queries, given as parallel
+        arrays (or scalars), against every tile at once.
+        returns a (k, n_tiles) bool array, True where the tile fits the query
+        '''
+        edge = np.asarray(edge_id_masks, dtype=np.uint8).reshape(-1, 1)
+        border = np.asarray(border_point_masks, dtype=np.uint8).reshape(-1, 1)
+        sflgs = np.asarray(special_flags, dtype=np.uint8).reshape(-1, 1)
+        border_ignore_mask = ~(sflgs | self.special_flags) & 0b1111
+        border_match = SHRINK_TO_4BIT_NP[border ^ self.border_point_masks] & border_ignore_mask
+        edge_match = edge ^ self.edge_id_masks
+        return (border_match | edge_match) & select_mask == 0
+
+    def match_indices(self, edge_id_mask, border_point_mask, special_flags, select_mask = int("1111", 2)):
+        '''indices into self.tiles of every tile fitting a single query'''
+        return np.flatnonzero(self.match_mask(edge_id_mask, border_point_mask, special_flags, select_mask)[0])
+
+    def match_indices_batch(self, edge_id_masks, border_point_masks, special_flags, select_mask = int("1111", 2)):
+        '''
+        match_indices for a whole batch of queries (say, a row of cells) in one pass.
+        returns a list holding an index array per query
+        '''
+        query, tile = np.nonzero(self.match_mask(edge_id_masks, border_point_masks, special_flags, select_mask))
+        splits = np.searchsorted(query, np.arange(1, len(np.atleast_1d(edge_id_masks))))
+        return np.split(tile, splits)
+
+    def solver_tables(self):
+        '''
+        Bitset tables (bit n == self.tiles[n]) for MapMaker._propagating_map:
+          by_edge[eid] : tiles with that edge mask
+          side_groups[side][k], side_compat[side][k] : tiles whose border and ignore flag
+            on side fall in group k, and every tile allowed across that side from them
+        side follows TileSide order, TOP, RHT, BOT, LFT, i.e. 0..3
+        '''
+        if self._solver_tables is not None:
+            return self._solver_tables
+        everything = (1 << len(self.tiles)) - 1
+        by_edge = [0]*16
+        for n, tile in enumerate(self.tiles):
+            by_edge[tile.edge_id_mask] |= 1 << n
+        side_groups, side_compat = [], []
+        for side in range(0, 4):
+            opposite = (side + 2) % 4
+            # who's on the far side of this edge, by their own border pair / ignore flag there
+            far_ignores = 0
+            far_by_border = [0]*4
+            groups = {}
+            for n, tile in enumerate(self.tiles):
+                if ( tile.special_flags >> opposite ) & 1:
+                    far_ignores |= 1 << n
+                far_by_border[( tile.border_point_mask >> 2*opposite ) & 0b11] |= 1 << n
+                key = (( tile.special_flags >> side ) & 1, ( tile.border_point_mask >> 2*side ) & 0b11)
+                groups[key] = groups.get(key, 0) | 1 << n
+            compat = []
+            for ignore, border in groups:
+                if ignore:
+                    compat.append(everything)
+                else:
+                    # the border encoding runs the other way round on the far side
+                    swapped = swap_border_pair(border)
+                    compat.append(far_ignores | far_by_border[swapped])
+            side_groups.append(list(groups.values()))
+            side_compat.append(compat)
+        self._solver_tables = (by_edge, side_groups, side_compat)
+        return self._solver_tables
+
+    '''
+    The find_* queries are all answered out of self._index.  Each query is first
+    reduced to a key holding only the bits that can change the answer, so every
+    cell that sees the same neighbourhood shares one entry.  Most of the key space
+    is never queried, so an entry is filled in by one vectorized pass over the mask
+    arrays the first time its key shows up, and is a dict lookup from then on.
+
+    The returned lists are shared between callers, so don't modify them.
+    '''
+    def tile_key(self, tile: TileElement, select_mask = int("1111", 2)):
+        # borders only count on selected sides that the query doesn't ignore
+        border_select = select_mask & ~tile.special_flags & 0b1111
+        return ("tile",
+                tile.edge_id_mask & select_mask,
+                tile.border_point_mask & SIDE_TO_BORDER_BITS[border_select],
+                border_select,
+                select_mask)
+
     def find_tile(self, tile: TileElement, select_mask = int("1111", 2)):
-        def MatchTileMask(candidate):
-            return tile.ismatching(candidate, select_mask)
-        matches = [tile for tile, match in zip(self.tiles, map(MatchTileMask, self.tiles)) if match is True] 
+        key = self.tile_key(tile, select_mask)
+        matches = self._index.get(key)
+        if matches is None:
+            self.index_misses += 1
+            hits = self.match_indices(tile.edge_id_mask, tile.border_point_mask, tile.special_flags, select_mask)
+            matches = [self.tiles[idx] for idx in hits]
+            self._index[key] = matches
         return matches
 
     def find_border_mask(self, brdmask, selectmask = int("1111", 2)):
-        def MatchBorderMask(tile):
-            # clear any selectmask bits if this tile doesn't care about them
-            tmpselect = selectmask & ( ~(tile.special_flags) & 0b1111 )
-            return (tile.border_point_mask ^ brdmask) & expand_to_8bit(tmpselect) == 0
-        matches = [tile for tile, match in zip(self.tiles, map(MatchBorderMask, self.tiles)) if match is True] 
+        key = ("border", brdmask & EXPAND_TO_8BIT[selectmask], selectmask)
+        matches = self._index.get(key)
+        if matches is None:
+            self.index_misses += 1
+            # clear any selectmask bits if a tile doesn't care about them
+            tmpselect = selectmask & ~self.special_flags & 0b1111
+            hits = np.flatnonzero((self.border_point_masks ^ brdmask) & EXPAND_TO_8BIT_NP[tmpselect] == 0)
+            matches = [self.tiles[idx] for idx in hits]
+            self._index[key] = matches
         return matches
 
     def find_edge_mask(self, edgemask, selectmask = int("1111", 2)):
-        def MatchEdgeMask(tile):
-            return ( tile.edge_id_mask ^ edgemask ) & selectmask == 0
-        matches = [tile for tile, match in zip(self.tiles, map(MatchEdgeMask, self.tiles)) if match is True] 
+        key = ("edge", edgemask & selectmask, selectmask)
+        matches = self._index.get(key)
+        if matches is None:
+            self.index_misses += 1
+            hits = np.flatnonzero(( self.edge_id_masks ^ edgemask ) & selectmask == 0)
+            matches = [self.tiles[idx] for idx in hits]
+            self._index[key] = matches
         return matches
 
-    def create_numpy_array_for_tile_map(self, map_width, map_height):
-        full_width = self.tile_width * map_width
-        full_height = self.tile_height * map_height
+    def coverage(self):
+        '''
+        Every find_tile() query MapMaker can put to this tile set, and how many tiles
+        answer it, so gaps show up here instead of as a run dying on an empty candidate list.
+
+        A query is made for a cell from its four verticies and the tiles already next to it.
+        Every layout of the cell's verticies is tried, with every subset of its sides having
+        a neighbour (the greedy scan has one above and to the left; strips and reroll() add
+        fixed tiles on any side).  A neighbour can be any tile whose edge mask fits the
+        verticies it shares with the cell and either of its own outer ones.  Neighbours are
+        taken on their own, so a query counted here might need neighbours that can't all
+        be placed together.  The propagating solver only makes these queries for cells
+        against a boundary.
+
+        returns a list with a dict per distinct constraint key (see tile_key), of
+          edgemask, bordermask, sflg : the query, as TileElement masks
+          matches : how many tiles fit it
+          pinned  : each set of sides with a neighbour it comes up for, as lists of TileSide names
+          scan    : whether the greedy scan of an unbounded map can ask it
+          example : where it comes up, as the cell's "vertices" [[top left, top right],
+                    [bottom left, bottom right]] and a "neighbours" tile index for each pinned side
+        '''
+        # the 2x2 verticies of the neighbour on each side, in TileSide order, from the cell's
+        # (tl, tr, bl, br) and the neighbour's two outer ones (a, b)
+        neighbour_verts = (
+            lambda tl, tr, bl, br, a, b: ((a, b), (tl, tr)),
+            lambda tl, tr, bl, br, a, b: ((tr, a), (br, b)),
+            lambda tl, tr, bl, br, a, b: ((bl, br), (a, b)),
+            lambda tl, tr, bl, br, a, b: ((a, tl), (b, bl)),
+        )
+        sides = list(TileSide)
+        # (side, neighbour edge mask) -> {(border pair, ignore flag) it pins on the cell: a tile pinning it}
+        pins = {}
+        for n, t in enumerate(self.tiles):
+            for side in range(0, 4):
+                far = sides[(side + 2) % 4]
+                pin = (swap_border_pair(t.border_id(far)), t.ignore_border_flag(far))
+                pins.setdefault((side, t.edge_id_mask), {}).setdefault(pin, n)
+
+        queries = {} # constraint key -> its record
+        for tl, tr, bl, br in itertools.product((0, 1), repeat=4):
+            eid = int(cell_edge_masks([[tl, tr], [bl, br]])[0, 0])
+            options = []
+            for side in range(0, 4):
+                found = {}
+                for a, b in itertools.product((0, 1), repeat=2):
+                    neid = int(cell_edge_masks(neighbour_verts[side](tl, tr, bl, br, a, b))[0, 0])
+                    for pin, n in pins.get((side, neid), {}).items():
+                        found.setdefault(pin, n)
+                options.append(found)
+            for pinned in range(0, 16):
+                on = [side for side in range(0, 4) if ( pinned >> side ) & 1]
+                for combo in itertools.product(*(options[side].items() for side in on)):
+                    bpm, sflgs = 0, 0b1111
+                    for side, ((border, ignore), _) in zip(on, combo):
+                        bpm |= border << 2*side
+                        sflgs &= ~(( 1 - ignore ) << side)
+                    query = TileElement(bpm, eid, sflgs, None)
+                    key = self.tile_key(query)
+                    record = queries.get(key)
+                    if record is None:
+                        record = {"edgemask": eid, "bordermask": bpm, "sflg": sflgs, "matches": None, "pinned": [], "scan": False,
+                                  "example": {"vertices": [[tl, tr], [bl, br]],
+                                              "neighbours": {sides[side].name: n for side, (_, n) in zip(on, combo)}}}
+                        queries[key] = record
+                    names = [sides[side].name for side in on]
+                    if names not in record["pinned"]:
+                        record["pinned"].append(names)
+                    record["scan"] |= pinned & 0b0110 == 0 # nothing to the right or below
+
+        records = list(queries.values())
+        for start in range(0, len(records), 4096):
+            chunk = records[start:start+4096]
+            hits = self.match_mask([r["edgemask"] for r in chunk], [r["bordermask"] for r in chunk], [r["sflg"] for r in chunk]).sum(axis=1)
+            for record, count in zip(chunk, hits.tolist()):
+                record["matches"] = count
+        return records
+
+    def create_numpy_array_for_tile_map(self, map_width, map_height, tile_wh=None):
+        tile_width, tile_height = self._tile_wh(tile_wh)
+        full_width = tile_width * map_width
+        full_height = tile_height * map_height
         return np.zeros((full_height, full_width, self.tile_channels), dtype=self.tile_dtype)
     
-    def insert_tile(self, dataimg, x, y, element: TileElement):
-        ys = y*self.tile_height
-        ye = (y+1)*self.tile_height
-        xs = x*self.tile_width
-        xe = (x+1)*self.tile_width
-        dataimg[ys:ye,xs:xe,:] = np.asarray(Image.fromarray(element.render()).resize((self.tile_height, self.tile_width)))
+    def insert_tile(self, dataimg, x, y, element: TileElement, tile_wh=None):
+        tile_width, tile_height = self._tile_wh(tile_wh)
+        ys = y*tile_height
+        ye = (y+1)*tile_height
+        xs = x*tile_width
+        xe = (x+1)*tile_width
+        pixels = self.tile_pixels(element)
+        if (tile_width, tile_height) != (self.tile_width, self.tile_height):
+            pixels = resize_tiles(pixels[np.newaxis], (tile_width, tile_height))[0]
+        dataimg[ys:ye,xs:xe,:] = pixels
         return dataimg
 
-    def _parse_tile_width_height(self, json_file: str):
-        with open(json_file, 'r') as fid:
-            obj = json.load(fid)
-            return obj["tile_width"], obj["tile_height"]
+    def scaled_tile_wh(self, scale=None, target_px_per_tile=None):
+        '''
+        (width, height) of a tile drawn at scale times full size, or target_px_per_tile
+        across (which wins if both are given).  Full size if neither is.
+        '''
+        if target_px_per_tile is not None:
+            if target_px_per_tile <= 0:
+                raise ValueError(f"target_px_per_tile {target_px_per_tile} should be more than 0")
+            scale = target_px_per_tile / self.tile_width
+        if scale is not None and not scale > 0:
+            raise ValueError(f"scale {scale} should be more than 0")
+        if scale is None:
+            return self.tile_width, self.tile_height
+        return max(1, round(self.tile_width*scale)), max(1, round(self.tile_height*scale))
+
+    def _tile_wh(self, tile_wh):
+        return (self.tile_width, self.tile_height) if tile_wh is None else tuple(tile_wh)
+
+    def tile_index(self, element: TileElement):
+        '''
+        Position of element in self.tiles (and so in the atlas), or None if it isn't one of ours
+        '''
+        if self._tile_indices is None:
+            self._tile_indices = {tile: idx for idx, tile in enumerate(self.tiles)}
+        return self._tile_indices.get(element)
+
+    def fingerprint(self):
+        '''
+        Hash of everything a tile index means: each tile's masks and image file, in order.
+        Saved maps record it, so they're only ever loaded against the tile set they index.
+        '''
+        h = hashlib.sha256()
+        for t in self.tiles:
+            turned = "" if t.rotation == TileRotation.NONE else f",{t.rotation.name}"
+            h.update(f"{t.border_point_mask},{t.edge_id_mask},{t.special_flags},{t.imgfile}{turned}\n".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def has_rotations(self):
+        # whether the tiles include turned copies, as rotations=True (or a set compiled with it) makes
+        return any(t.rotation != TileRotation.NONE for t in self.tiles)
+
+    def is_weighted(self):
+        # whether any tile has a weight or a count, so picks need a TileSampler
+        return any(t.weight != 1 or t.count is not None for t in self.tiles)
+
+    def has_inventory(self):
+        # whether any piece has a count, so maps need checking against them
+        return any(t.count is not None for t in self.tiles)
+
+    def inventory(self):
+        '''
+        The physical pieces behind self.tiles: the piece number of every tile, and the
+        count of every piece, None where there's no limit
+        '''
+        if self._inventory is None:
+            pieces = {}
+            counts = []
+            for t in self.tiles:
+                if t.piece not in pieces:
+                    pieces[t.piece] = len(counts)
+                    counts.append(t.count)
+                elif counts[pieces[t.piece]] != t.count:
+                    raise ValueError(f"records for {t.piece} disagree on its count")
+            self._inventory = ([pieces[t.piece] for t in self.tiles], counts)
+            # the same as an array over atlas indices, the blank tile on a piece of its own past the rest
+            self._piece_index = np.array(self._inventory[0] + [len(counts)], dtype=np.intp)
+        return self._inventory
+
+    def inventory_used(self, tile_grid):
+        # pieces a grid of tile indices uses, as an array over inventory()'s pieces
+        npieces = len(self.inventory()[1])
+        return np.bincount(self._piece_index[np.asarray(tile_grid).ravel()], minlength=npieces+1)[:npieces]
+
+    def blank_index(self):
+        # the atlas keeps a blank tile after the real ones
+        return len(self.tiles)
+
+    def tile_atlas(self, tile_wh=None):
+        '''
+        Every tile's pixels stacked into one (n_tiles+1, tile_height, tile_width, channels)
+        array, in the order of self.tiles, with the blank tile at blank_index()
+
+        With tile_wh, the same at that (width, height) instead.  Smaller sizes come off a
+        pyramid of atlases, each half the size of the one before, built once; a size between
+        levels is resized from the next level up, so it never costs more than about four
+        times its own pixels, however big the full size tiles are.
+        '''
+        tile_wh = self._tile_wh(tile_wh)
+        if tile_wh != (self.tile_width, self.tile_height):
+            return self._scaled_atlas(tile_wh)
+        if self._atlas is None:
+            atlas = np.empty((len(self.tiles)+1, self.tile_height, self.tile_width, self.tile_channels), dtype=self.tile_dtype)
+            for idx, tile in enumerate(self.tiles):
+                atlas[idx] = self.tile_pixels(tile)
+            atlas[self.blank_index()] = self.tile_pixels(TileElement(0b0000,0b0000,0b0000,None))
+            atlas.flags.writeable = False
+            self._atlas = atlas
+            # tile_pixels() serves from the atlas now, so the decoded copies are just a second one
+            self._image_cache.clear()
+            self._trim_atlases(atlas)
+            return atlas
+        return self._atlas
+
+    def atlas_nbytes(self):
+        # memory the atlases hold; a compiled tile set's full atlas is the file's pages, not ours
+        held = [self._atlas] + (self._pyramid or []) + list(self._scaled_atlases.values())
+        unique = {id(a): a for a in held if a is not None and not isinstance(a, np.memmap)}
+        return sum(a.nbytes for a in unique.values())
+
+    def _trim_atlases(self, keep):
+        '''
+        Lets go of atlases until they fit in cache_bytes: the resized ones, oldest first,
+        then the pyramid, then the full atlas.  keep is about to be handed out, so it's let
+        go of last, and only by dropping the reference; the caller still has it
+        '''
+        budget = self._image_cache.max_bytes
+        for tile_wh in list(self._scaled_atlases):
+            if self.atlas_nbytes() <= budget:
+                return
+            if self._scaled_atlases[tile_wh] is not keep:
+                del self._scaled_atlases[tile_wh]
+        if self.atlas_nbytes() > budget and self._pyramid is not None and not any(level is keep for level in self._pyramid[1:]):
+            self._pyramid = None
+        if self.atlas_nbytes() > budget:
+            # keep is a resized atlas or pyramid level the full atlas can't be held with, or too big itself
+            self._scaled_atlases.clear()
+            self._pyramid = None
+            if self._compiled is None:
+                self._atlas = None
+
+    def _scaled_atlas(self, tile_wh):
+        tile_width, tile_height = tile_wh
+        if self._pyramid is None:
+            self._pyramid = [self.tile_atlas()]
+        # halve down until the next level would be smaller than what's asked for
+        while True:
+            level = self._pyramid[-1]
+            half_h, half_w = -(-level.shape[1] // 2), -(-level.shape[2] // 2)
+            if half_w < max(tile_width, PYRAMID_MIN_PX) or half_h < max(tile_height, PYRAMID_MIN_PX):
+                break
+            self._pyramid.append(halve_tiles(level))
+        for level in reversed(self._pyramid):
+            if level.shape[2] >= tile_width and level.shape[1] >= tile_height:
+                break
+        if level.shape[1:3] == (tile_height, tile_width):
+            atlas = level
+        else:
+            atlas = self._scaled_atlases.get(tile_wh)
+            if atlas is None:
+                atlas = resize_tiles(level, tile_wh)
+                atlas.flags.writeable = False
+                self._scaled_atlases[tile_wh] = atlas
+                while len(self._scaled_atlases) > SCALED_ATLAS_SIZES:
+                    self._scaled_atlases.popitem(last=False)
+            else:
+                self._scaled_atlases.move_to_end(tile_wh)
+        self._trim_atlases(atlas)
+        return atlas
+
+    def render_tile_grid(self, tile_grid, dataimg=None, tile_wh=None):
+        '''
+        Fill a create_numpy_array_for_tile_map() image from an integer grid of atlas
+        indices, shape (map_height, map_width).  Each row of tiles is a single gather
+        out of the atlas, written straight into the board through a
+        (map_h, tile_h, map_w, tile_w, channels) view of it, so there's no per-cell
+        Python work and no second board-sized temporary.
+
+        tile_wh draws the tiles at that (width, height), see tile_atlas()
+        '''
+        tile_width, tile_height = self._tile_wh(tile_wh)
+        tile_grid = np.asarray(tile_grid)
+        map_height, map_width = tile_grid.shape
+        if dataimg is None:
+            dataimg = self.create_numpy_array_for_tile_map(map_width, map_height, tile_wh)
+        tiled = dataimg.reshape(map_height, tile_height, map_width, tile_width, self.tile_channels)
+        for row in range(0, map_height):
+            self.render_tile_row(tile_grid[row], tiled[row], tile_wh)
+        return dataimg
 
-    def _parse_tiles(self, json_file: str):
-        with open(json_file, 'r') as fid:
-            obj = json.load(fid)
-            result = []
-            for c in obj["tile_list"]:
-                result.append(TileElement(border_point_mask=int(c["bordermask"][::-1], 2), edge_id_mask=int(c["edgemask"][::-1],2), special_flags=int(c["sflg"][::-1],2), imgfile=c["file"]))
-            return result
+    def render_tile_row(self, tile_row, band=None, tile_wh=None):
+        '''
+        One row of tiles out of the atlas, as a (tile_height, n*tile_width, channels) band.
+        band may also be handed in already viewed as (tile_height, n, tile_width, channels).
+        '''
+        tile_width, tile_height = self._tile_wh(tile_wh)
+        atlas = self.tile_atlas(tile_wh)
+        n = len(tile_row)
+        if band is None:
+            band = np.empty((tile_height, n * tile_width, self.tile_channels), dtype=self.tile_dtype)
+        # (n, tile_h, tile_w, c) -> (tile_h, n, tile_w, c)
+        band.reshape(tile_height, n, tile_width, self.tile_channels)[...] = atlas[tile_row].transpose(1, 0, 2, 3)
+        return band
+
+    def tile_pixels(self, element: TileElement):
+        '''
+        The tile's image at tile_width x tile_height, decoded and resized once per
+        TileSet and served out of the image cache after that.  Turned tiles are a
+        turned view of their image file's entry.
+        '''
+        if self._atlas is not None:
+            # already stacked up (or mapped in from a compiled tile set)
+            idx = self.blank_index() if element.imgfile is None else self.tile_index(element)
+            if idx is not None:
+                return self._atlas[idx]
+        key = element.imgfile
+        pixels = self._image_cache.get(key)
+        if pixels is None:
+            from PIL import Image
+            img = Image.fromarray(element.render(self.tile_directory)).convert("RGB").resize((self.tile_width, self.tile_height))
+            pixels = np.asarray(img, dtype=self.tile_dtype)
+            self._image_cache.put(key, pixels)
+        if element.rotation != TileRotation.NONE:
+            pixels = rotate_pixels(pixels, element.rotation)
+            if pixels.shape[:2] != (self.tile_height, self.tile_width):
+                # not square, so a quarter turn doesn't fit the tile any more
+                pixels = resize_tiles(pixels[np.newaxis], (self.tile_width, self.tile_height))[0]
+        return pixels
+
+    def _parse_tile_width_height(self, obj: dict):
+        return obj["tile_width"], obj["tile_height"]
+
+    @staticmethod
+    def tile_directory_of(json_file, obj: dict):
+        # the "file"s of a tile set's records are relative to its .json, and its "tile_directory" under that
+        return os.path.join(os.path.dirname(json_file), obj.get("tile_directory", ""))
+
+    @staticmethod
+    def parse_record(c: dict):
+        '''one tile_list record as a TileElement'''
+        weight, count = float(c.get("weight", 1.0)), c.get("count")
+        if weight < 0 or (count is not None and count < 0):
+            raise ValueError(f"{c['file']}: weight and count can't be negative")
+        return TileElement(border_point_mask=parse_mask(c["bordermask"]), edge_id_mask=parse_mask(c["edgemask"]), special_flags=parse_mask(c["sflg"]), imgfile=c["file"],
+                           weight=weight, count=count, piece=c.get("piece"))
+
+    def _parse_tiles(self, obj: dict):
+        return [TileSet.parse_record(c) for c in obj["tile_list"]]
 
 # ================================================================================= #
 #             __  __               __  __       _    _             
@@ -276,223 +930,1059 @@ class TileSet:
 #            |_|  |_|\__,_| .__/  |_|  |_|\__,_|_|\_\_|_| |_|\__, |
 #                         |_|                                |___/ 
 # ================================================================================= #
+class PngStreamWriter:
+    '''
+    Writes an 8-bit RGB PNG a band of rows at a time, so the full image never has
+    to exist in memory (PIL wants the whole thing up front)
+    '''
+    def __init__(self, filename, width, height, level=6):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._fid = open(filename, 'wb')
+        self._zip = zlib.compressobj(level)
+        self._fid.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per channel, truecolour, default compression/filter, no interlace
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._fid.write(struct.pack(">I", len(data)))
+        self._fid.write(kind)
+        self._fid.write(data)
+        self._fid.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def write_rows(self, rows):
+        '''rows : (n, width, 3) uint8'''
+        assert(rows.shape[1:] == (self.width, 3))
+        # every scanline starts with its filter type, 0 == none
+        scanlines = np.zeros((rows.shape[0], 1 + 3*self.width), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(rows.shape[0], -1)
+        data = self._zip.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self._fid.closed:
+            return
+        self._chunk(b"IDAT", self._zip.flush())
+        self._chunk(b"IEND", b"")
+        self._fid.close()
+        assert(self.rows_written == self.height)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self._fid.close()
+
+# ---------------------------------------------------------------------------------
+# Vertex strategies
+#
+# These lay out the continents, as a (height+1, width+1) uint8 grid of map verticies,
+# 1 for land and 0 for ocean, before any tiles get matched.  Each is handed a numpy
+# Generator and takes all of its randomness from that.  Register new ones with
+# @vertex_strategy("name") and they show up in MapMaker and on the command line.
+# ---------------------------------------------------------------------------------
+VERTEX_STRATEGIES = {}
+
+def vertex_strategy(name):
+    def register(fn):
+        VERTEX_STRATEGIES[name] = fn
+        return fn
+    return register
+
+def sink_rim(grid):
+    # the outermost verticies are always ocean
+    grid[0, :] = 0
+    grid[-1, :] = 0
+    grid[:, 0] = 0
+    grid[:, -1] = 0
+    return grid
+
+def box_sum3(grid):
+    # 2D convolution with a 3x3 box (zero padded): how much land is around each vertex
+    rows, cols = grid.shape
+    padded = np.pad(grid.astype(np.int16), 1)
+    return sum(padded[dr:dr+rows, dc:dc+cols] for dr in range(0,3) for dc in range(0,3))
+
+@vertex_strategy("random")
+def random_strategy(width, height, rng):
+    grid = (rng.random((height+1, width+1)) > 0.30).astype(np.uint8)
+    return sink_rim(grid)
+
+@vertex_strategy("parceled")
+def parceled_strategy(width, height, rng):
+    # divide up the possible verticies into 2 groups, either side of a jittered centre column:
+    #
+    #   +--------------+
+    #   |     |        |
+    #   |     |        |
+    #   |     |        |
+    #   +--------------+
+    #
+    # each parcel is random inside, with its own ocean rim
+    ncols = width+1
+    split = min(max(0, ncols//2 + int(rng.integers(-2, 4))), ncols)
+    grid = (rng.random((height+1, ncols)) > 0.30).astype(np.uint8)
+    for start, stop in ((0, split), (split, ncols)):
+        if stop > start:
+            sink_rim(grid[:, start:stop])
+    return grid
+
+@vertex_strategy("single_continent")
+def single_continent_strategy(width, height, rng):
+    # just draw a rectangle and fill in the interior with land verts
+    grid = np.zeros((height+1, width+1), dtype=np.uint8)
+    centers = [(height+1)//2, (width+1)//2]
+    off = [(height+1)//4, (width+1)//4]
+    grid[off[0]:centers[0], off[1]:centers[1]] = 1
+    return grid
+
+@vertex_strategy("value_noise")
+def value_noise_strategy(width, height, rng, feature_size=6, land=0.45):
+    '''
+    Smooth blobby continents: random values on a lattice feature_size verticies apart,
+    interpolated up to the vertex grid, faded out towards the rim, then thresholded so
+    about `land` of the verticies end up land
+    '''
+    nrows, ncols = height+1, width+1
+    lattice = rng.random((nrows // feature_size + 2, ncols // feature_size + 2))
+    ys = np.arange(nrows) / feature_size
+    xs = np.arange(ncols) / feature_size
+    y0 = ys.astype(np.intp)
+    x0 = xs.astype(np.intp)
+    # smoothstep the fractions, so the lattice doesn't show through
+    fy = (ys - y0)[:, None]
+    fx = (xs - x0)[None, :]
+    fy = fy*fy*(3 - 2*fy)
+    fx = fx*fx*(3 - 2*fx)
+    upper = lattice[y0][:, x0]*(1 - fx) + lattice[y0][:, x0+1]*fx
+    lower = lattice[y0+1][:, x0]*(1 - fx) + lattice[y0+1][:, x0+1]*fx
+    noise = upper*(1 - fy) + lower*fy
+    # distance from the rim, 0 on it, 1 a third of the way in and beyond
+    ry = np.minimum(np.arange(nrows), np.arange(nrows)[::-1])
+    rx = np.minimum(np.arange(ncols), np.arange(ncols)[::-1])
+    fade = np.clip(np.minimum.outer(ry, rx) / max(1.0, min(nrows, ncols) / 6), 0, 1)
+    noise *= fade
+    grid = (noise > np.quantile(noise, 1 - land)).astype(np.uint8)
+    return sink_rim(grid)
+
+@vertex_strategy("cellular")
+def cellular_strategy(width, height, rng, land=0.55, steps=4):
+    '''
+    Cave style cellular automaton: start from random soup, then on every step a vertex
+    becomes land if at least 5 of the 9 in its 3x3 neighbourhood are, which clumps the
+    noise up into coastlines
+    '''
+    grid = sink_rim((rng.random((height+1, width+1)) < land).astype(np.uint8))
+    for _ in range(0, steps):
+        grid = sink_rim((box_sum3(grid) >= 5).astype(np.uint8))
+    return grid
+
+def cell_edge_masks(verts):
+    '''
+    Edge id mask (TileElement encoding) of every map cell, from the vertex grid.
+    An edge is land when the verticies at both of its ends are.
+    returns a (height, width) uint8 grid
+    '''
+    verts = np.asarray(verts, dtype=np.uint8)
+    hedge = verts[:, :-1] & verts[:, 1:] # (height+1, width), running right from each vertex
+    vedge = verts[:-1, :] & verts[1:, :] # (height, width+1), running down from each vertex
+    return hedge[:-1, :] | vedge[:, 1:] << 1 | hedge[1:, :] << 2 | vedge[:, :-1] << 3
+
+class MapTrace:
+    '''
+    Opt-in instrumentation for MapMaker, handed in as MapMaker(..., trace=MapTrace()).
+    It collects
+      timings          : wall clock seconds per phase: strategy, edges, matching, render
+      candidates       : histogram, candidate tile count -> number of cells placed with that many
+      empty_candidates : (col, row) of every cell that ran out of candidates
+      image_cache      : tile image cache hits and misses
+      index            : find_* index misses, i.e. queries that had to scan the tile set
+    and, if given a callback, also reports phases and empty cells to callback(event, data)
+    as they happen.  Without a trace MapMaker does none of this.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timings = {}
+        self.candidates = {}
+        self.empty_candidates = []
+        self.image_cache = {"hits": 0, "misses": 0}
+        self.index = {"misses": 0}
+
+    @contextlib.contextmanager
+    def phase(self, name, tile_set=None):
+        cache = tile_set._image_cache if tile_set is not None else None
+        if cache is not None:
+            hits, misses, index_misses = cache.hits, cache.misses, tile_set.index_misses
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            if cache is not None:
+                self.image_cache["hits"] += cache.hits - hits
+                self.image_cache["misses"] += cache.misses - misses
+                self.index["misses"] += tile_set.index_misses - index_misses
+            if self.callback is not None:
+                self.callback("phase", {"name": name, "seconds": elapsed})
+
+    def placed(self, count):
+        self.candidates[count] = self.candidates.get(count, 0) + 1
+
+    def ran_out(self, col, row):
+        self.empty_candidates.append((col, row))
+        if self.callback is not None:
+            self.callback("empty_candidates", {"col": col, "row": row})
+
+    def to_dict(self):
+        return {
+            "timings": dict(self.timings),
+            "candidates": {str(k): v for k, v in sorted(self.candidates.items())},
+            "empty_candidates": [list(loc) for loc in self.empty_candidates],
+            "image_cache": dict(self.image_cache),
+            "index": dict(self.index),
+        }
+
+    def to_json(self, filename=None):
+        text = json.dumps(self.to_dict(), indent=4)
+        if filename is not None:
+            with open(filename, 'w') as fid:
+                fid.write(text)
+        return text
+
+class TileSampler:
+    '''
+    Weighted tile picks for one map, keeping to the tile set's inventory.
+    tile_set : TileSet
+    remaining : optional copies left of each piece, as inventory() counts them.  Default is
+        the whole inventory
+
+    Every constraint key gets a Walker alias table over its candidates the first time it
+    comes up, so a pick is a randrange and a random() however many candidates there are.
+    take() puts a piece down; when a pick lands on a tile whose piece has run out, it is
+    thrown back and that key's table is rebuilt without it.  So a table gets rebuilt once
+    per piece running out, not on every placement.  All randomness comes from `random`.
+    '''
+    def __init__(self, tile_set, remaining=None):
+        self.tile_set = tile_set
+        self._piece_of, counts = tile_set.inventory()
+        self.remaining = list(counts if remaining is None else remaining)
+        self._weights = [t.weight for t in tile_set.tiles]
+        self._tables = {} # constraint key -> (tile indices, alias probabilities, aliases)
+
+    def available(self, idx):
+        left = self.remaining[self._piece_of[idx]]
+        return left is None or left > 0
+
+    def take(self, idx):
+        piece = self._piece_of[idx]
+        if self.remaining[piece] is not None:
+            self.remaining[piece] -= 1
+
+    def give_back(self, idx):
+        piece = self._piece_of[idx]
+        if self.remaining[piece] is not None:
+            self.remaining[piece] += 1
+
+    def pick(self, tile: TileElement, select_mask = int("1111", 2)):
+        '''
+        index of a tile fitting the find_tile() query, by weight, among those left.
+        None if there are none
+        '''
+        key = self.tile_set.tile_key(tile, select_mask)
+        table = self._tables.get(key)
+        if table is None:
+            table = self._alias_table(self.tile_set.tile_index(t) for t in self.tile_set.find_tile(tile, select_mask))
+            self._tables[key] = table
+        while table[0]:
+            idx = self._draw(table)
+            if self.available(idx):
+                return idx
+            table = self._alias_table(table[0])
+            self._tables[key] = table
+        return None
+
+    def pick_bit(self, domain, eid, held=False):
+        '''
+        For MapMaker._propagating_map: the bit of a tile in the domain bitset, by weight,
+        among those left.  Draws from the table of every tile with edge mask eid, which
+        holds the whole domain, falling back to a scan of the domain after SAMPLER_TRIES
+        misses.  0 if there are none
+        held : the cell already holds the one piece every tile in the domain is a side of,
+            so they're picked from whether any more of it are left or not
+        '''
+        if not held:
+            key = ("edge", eid)
+            table = self._tables.get(key)
+            if table is None:
+                table = self._alias_table(np.flatnonzero(self.tile_set.edge_id_masks == eid).tolist())
+                self._tables[key] = table
+            for _ in range(0, SAMPLER_TRIES):
+                if not table[0]:
+                    break
+                idx = self._draw(table)
+                if not self.available(idx):
+                    table = self._alias_table(table[0])
+                    self._tables[key] = table
+                elif ( domain >> idx ) & 1:
+                    return 1 << idx
+        left = []
+        while domain:
+            bit = domain & -domain
+            domain ^= bit
+            if (held or self.available(bit.bit_length() - 1)) and self._weights[bit.bit_length() - 1] > 0:
+                left.append(bit)
+        if not left:
+            return 0
+        return random.choices(left, weights=[self._weights[bit.bit_length() - 1] for bit in left])[0]
+
+    @staticmethod
+    def _draw(table):
+        indices, prob, alias = table
+        n = random.randrange(len(indices))
+        return indices[n] if random.random() < prob[n] else indices[alias[n]]
+
+    def _alias_table(self, indices):
+        # Vose's alias method, over the tiles still available
+        indices = [idx for idx in indices if self.available(idx) and self._weights[idx] > 0]
+        n = len(indices)
+        if n == 0:
+            return indices, [], []
+        total = sum(self._weights[idx] for idx in indices)
+        scaled = [self._weights[idx] * n / total for idx in indices]
+        prob, alias = [1.0]*n, list(range(0, n))
+        small = [k for k, p in enumerate(scaled) if p < 1]
+        large = [k for k, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less], alias[less] = scaled[less], more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        return indices, prob, alias
+
 class MapPixel:
+    # a cell of a MapMaker map, handed out by MapMaker.pixels(); the map itself is kept as a grid of tile indices
+    __slots__ = ("location_xy", "element")
+
     def __init__(self, location_xy, element = None):
         self.location_xy = location_xy
         self.element = element
-        self.neighbors = get_4adj_neighbors(self.location_xy)
-        
-    
+
 
 class MapMaker:
     '''
-    tile_set : list of dict
+    tile_set : TileSet
     map_wh : tuple of int
+    strategy : str, one of VERTEX_STRATEGIES
+    solver : str, one of MapMaker.SOLVERS
+    max_backtracks : int, only used by the "propagate" solver
+    vertices : optional (height+1, width+1) vertex grid to tile, instead of running the strategy
+    trace : optional MapTrace, to collect timings and matching stats
+    boundary : optional (top, rht, bot, lft) lists of the tiles just outside the board, in
+        TileSide order, width long for top and bot and height long for rht and lft.  Lists
+        or entries may be None where there's nothing to fit against.  The map is solved to
+        fit against them, as if they were already placed neighbours.
+    strips : cut the board into this many strips of rows and match them in parallel,
+        see _strip_map
+    workers : worker processes for strips.  Default is one per core
+    seed : optional seed for `random`, seeded with it here and remembered for save()
+    tile_grid : optional (height, width) grid of tile indices to take as the map, instead of
+        solving for one.  Needs vertices too; see load()
+    inventory : optional copies left of each piece to make the map from, as
+        TileSet.inventory() counts them.  Default is the tile set's whole inventory.
+        Only used with a tile set that is_weighted(), whose tiles get picked by weight and
+        never more of a piece than there is; see TileSampler.  Both solvers, and strips,
+        take pieces as they place them, so a board that would need more is a dead end
+
+    The map is kept as tile_grid, an int16 (height, width) grid of indices into
+    tile_set.tiles, alongside the uint8 vertex grid it was tiled from.
     '''
-    def __init__(self, tile_set, map_wh):
+    SOLVERS = {
+        "greedy": "_the_real_random_map",
+        "propagate": "_propagating_map",
+    }
+
+    def __init__(self, tile_set, map_wh, strategy="parceled", solver="greedy", max_backtracks=SOLVER_MAX_BACKTRACKS, vertices=None, trace=None,
+                 boundary=None, strips=1, workers=None, seed=None, tile_grid=None, inventory=None):
         self.width, self.height = map_wh
         self.tile_set = tile_set
-        self._map = self._create_map() # a list of MapPixels
+        self.trace = trace
+        self.strategy = strategy
+        self.solver = solver
+        self.max_backtracks = max_backtracks
+        self.boundary = boundary
+        self.strips = strips
+        self.workers = workers
+        self._vertices = vertices # the strategy's vertex grid
+        self._image = None # what render() last drew, and at what tile size, so reroll() can patch it
+        self._image_tile_wh = None
+        self.seed = seed
+        self.rerolls = [] # rects reroll()ed since, as the seed alone no longer makes this map
+        if seed is not None:
+            random.seed(seed)
+        # plain uniform picks otherwise, as they always were, so seeds keep making the same maps
+        self._inventory = inventory
+        self._sampler = TileSampler(tile_set, inventory) if tile_set.is_weighted() else None
+        self._pieces_used = None # running count of each piece on the board, with an inventory to keep to
+        assert(len(tile_set.tiles) < 2**15) # tile indices are kept as int16
+        if tile_grid is not None:
+            assert(vertices is not None and tile_grid.shape == (self.height, self.width))
+            self.tile_grid = np.asarray(tile_grid, dtype=np.int16)
+        else:
+            self.tile_grid = self._create_map()
 
     '''
     The business
     '''
     def _create_map(self):
         # Now the fun begins.  
-        # working_map = self._the_real_random_map(self._random_strategy())
-        working_map = self._the_real_random_map(self._parceled_strategy())
-        # working_map = self._the_real_random_map(self._single_continent_strategy())
-        return working_map
+        # the strategies run off numpy's generator, seeded from `random` so seeding that still pins down the map
+        if self._vertices is None:
+            with self._phase("strategy"):
+                rng = np.random.default_rng(random.getrandbits(64))
+                self._vertices = VERTEX_STRATEGIES[self.strategy](self.width, self.height, rng)
+        assert(self._vertices.shape == (self.height+1, self.width+1))
+        with self._phase("edges"):
+            eids = cell_edge_masks(self._vertices)
+        solve = getattr(self, MapMaker.SOLVERS[self.solver])
+        with self._phase("matching"):
+            if self.strips > 1 and self.height >= 2*(2*STRIP_SEAM_ROWS + 1):
+                tile_grid = self._strip_map()
+            else:
+                tile_grid = solve(eids)
+        if self.tile_set.has_inventory():
+            self._pieces_used = self.tile_set.inventory_used(tile_grid)
+            counts = self._inventory_counts()
+            assert(not np.any((counts >= 0) & (self._pieces_used > counts))) # kept to as it was built
+        return tile_grid
+
+    def _inventory_counts(self):
+        # copies of each piece this map may use, -1 for no limit
+        counts = self._inventory if self._inventory is not None else self.tile_set.inventory()[1]
+        return np.array([-1 if count is None else count for count in counts], dtype=np.int64)
+
+    def _phase(self, name):
+        if self.trace is None:
+            return contextlib.nullcontext()
+        return self.trace.phase(name, self.tile_set)
 
     def _init_map(self):
-        result = []
-        for y in range(0,self.height):
-            for x in range(0, self.width):
-                result.append(MapPixel(location_xy=(x,y)))
-        return result
-
-    def _random_strategy(self):
-        def choose_randomly():
-            return 1 if random.random() > 0.30 else 0
-        def capture():
-            verts = []
-            for row in range(0, self.height+1):
-                for col in range(0, self.width+1):
-                    # initialize border verticies with 0 (ocean)
-                    edge_val = 0 if row == 0 or col == 0 or row == self.height or col == self.width else choose_randomly()
-                    verts.append(TileVertex(pt=(col,row), edge_id_mask=edge_val))
-            return verts
-        return capture
-
-    def _single_continent_strategy(self):
-        # just draw a rectangle and fill in the interior with land verts
-        grid = np.zeros((self.height+1, self.width+1))
-        centers = [(self.height+1)//2, ( self.width+1 )//2]
-        off = [( self.height+1 )//4, ( self.width+1 )//4]
-        grid[off[0]:centers[0], off[1]:centers[1]] = 1
-        #grid = add_noise(grid)
-        def capture():
-            verts = []
-            for row in range(0, grid.shape[0]):
-                for col in range(0, grid.shape[1]):
-                    # initialize border verticies with 0 (ocean)
-                    edge_val = grid[row,col]
-                    verts.append(TileVertex(pt=(col,row), edge_id_mask=edge_val))
-            return verts
-
-        return capture
-
-
-    def _parceled_strategy(self):
-        def choose_randomly():
-            return 1 if random.random() > 0.30 else 0
-        def create_parcels(width, height):
-            # divide up the possible verticies into 3(or 2) groups:
-            #
-            #   +--------------+
-            #   |     |        |
-            #   |-----*        |
-            #   |     |        |
-            #   +--------------+
-            center_point = [width//2, height//2]
-            # add noise
-            center_point[0] += random.randint(-2,3)
-            center_point[1] += random.randint(-2,3)
-            # we can now define 2 rectangles
-            rect1 = [0, 0, center_point[0], height]
-            rect2 = [center_point[0], 0, width - center_point[0], height]
-            rectlist = (rect1, rect2)
-
+        return np.full((self.height, self.width), self.tile_set.blank_index(), dtype=np.int16)
+
+    @staticmethod
+    def _constraint_tile(eid, top, rht, bot, lft):
+        '''
+        The tile a cell needs, as a TileElement query for TileSet.find_tile, from its edge
+        mask and the (border pair, ignore flag) pinned on each of its edges (None if free),
+        stored the way _the_real_random_map keeps them
+        '''
+        bpm = 0
+        sflgs = 0
+        for n, itr in enumerate((top,rht,bot,lft)):
+            if itr is None:
+                # nothing placed across this edge yet, so no border constraint on it
+                sflgs |= 1<<n
+                continue
+            brdmsk, sflg = itr
+            # need to switch the bits around if the edge is top or lft
+            # why?  because the top edge is another tile's bottom, 
+            # which, due to the encoding scheme, is backwards
+            # This only applies to the top and left because of the order
+            # of iteration through the edge list
+            if n == 0 or n == 3:
+                brdmsk = swap_border_pair(brdmsk)
+            bpm |= brdmsk << ( 2*n )
+            sflgs |= sflg << n
+        return TileElement(bpm, eid, sflgs, None)
+
+    def _boundary_pins(self):
+        '''
+        The boundary tiles as pinned edges, (top, rht, bot, lft) lists of (border pair,
+        ignore flag) or None, stored the way _the_real_random_map keeps its edges:
+        as the bottom of the tile above, and the right of the tile to the left
+        '''
+        top, bot = [None]*self.width, [None]*self.width
+        lft, rht = [None]*self.height, [None]*self.height
+        if self.boundary is None:
+            return top, rht, bot, lft
+        above, right, below, left = self.boundary
+        def pins(tiles, side: TileSide, swap):
             result = []
-            for r in rectlist:
-                x, y, w, h = r
-                points = []
-                for yy in range(y, y+h):
-                    for xx in range(x, x+w):
-                        points.append([xx,yy])
-                result.append(np.asarray(points))
+            for tile in tiles:
+                if tile is None:
+                    result.append(None)
+                    continue
+                border = tile.border_id(side)
+                result.append((swap_border_pair(border) if swap else border, tile.ignore_border_flag(side)))
             return result
-
-        parcels = create_parcels(self.width+1, self.height+1)
-
-        def capture():
-            def generate(parsec):
-                verts = []
-                minC, minR = np.min(parsec,0)
-                maxC, maxR = np.max(parsec,0)
-                for col, row in parsec:
-                    # initialize border verticies with 0 (ocean)
-                    if row == minR or col == minC or row == maxR or col == maxC:
-                        verts.append(TileVertex(pt=(col,row), edge_id_mask=0))
-                    else:
-                        verts.append(TileVertex(pt=(col,row), edge_id_mask=choose_randomly()))
-                return verts
-            verticies = []
-            for p in parcels:
-                for tmp in generate(p):
-                    verticies.append(tmp)
-            return verticies
-
-        return capture
-
-    def _the_real_random_map(self, vertex_assignment_strategy):
+        if above is not None:
+            top = pins(above, TileSide.BOT, False)
+        if right is not None:
+            rht = pins(right, TileSide.LFT, True)
+        if below is not None:
+            bot = pins(below, TileSide.TOP, True)
+        if left is not None:
+            lft = pins(left, TileSide.RHT, False)
+        return top, rht, bot, lft
+
+    def _the_real_random_map(self, eids):
         thismap = self._init_map()
+        trace = self.trace
 
         # we're going to define the edges, instead of wholesale tiles
         # then, we'll grab a match from the tile set since we should have the edges well defined
 
-        # apparently the way to go is to store both the verticies and the edges
-
-        # we'll start with a vertex approach
-        # IMPORTANT this is then entry point for continent creation algorithms
-        verts = vertex_assignment_strategy()
-
-        # iterate through each vertex, defining each edge ahead of it, with boundary clamping
-        def find_vert(vert_list, x, y):
-            result = [idx for idx, v in enumerate(vert_list) if v.pt == (x,y)]
-            assert(len(result) == 1)
-            return result[0]
-        edges = []
-        for row in range(0, self.height+1):
-            for col in range(0,self.width+1):
-                cur_idx = find_vert(verts, col, row)
-                # at this vertex, there is one extending to the right (maybe) 
-                # and one extending below (maybe)
-                if col+1 < self.width+1:
-                    cad_idx = find_vert(verts, col+1, row)
-                    edges.append(TileEdge(vert1=verts[cur_idx], vert2=verts[cad_idx]))
-                if row+1 < self.height+1:
-                    rad_idx = find_vert(verts, col, row+1)
-                    edges.append(TileEdge(vert1=verts[cur_idx], vert2=verts[rad_idx]))
+        # the verticies (the entry point for continent creation) pinned down the land/ocean edges...
+        eids = eids.tolist()
+
+        # ... but the border points crossing each edge only get pinned down as tiles are placed.
+        # An edge holds (border pair, ignore flag) from the tile that placed it, None until then:
+        #   hborder[row][col] runs from vertex (col,row) to (col+1,row)
+        #   vborder[row][col] runs from vertex (col,row) to (col,row+1)
+        hborder = [[None]*self.width for _ in range(0, self.height+1)]
+        vborder = [[None]*(self.width+1) for _ in range(0, self.height)]
+        # the board's own rim is already pinned down by any boundary tiles
+        top, rht, bot, lft = self._boundary_pins()
+        hborder[0], hborder[self.height] = top, bot
+        for row in range(0, self.height):
+            vborder[row][0], vborder[row][self.width] = lft[row], rht[row]
         
         # now that we have the edges defined, let's start making matches
         # we'll define the anchor point for a tile to be the top-left vertex
-        def find_edge(edge_list, pt1, pt2):
-            result = [(e,idx) for idx, e in enumerate(edge_list) if e.contains(pt1, pt2)]
-            assert(len(result) == 1)
-            return result[0]
-        def to_TileElement(top: TileEdge, lft: TileEdge, bot: TileEdge, rht: TileEdge):
-            bpm = 0
-            sflgs = 0
-            eid = 0
-            for n, itr in enumerate((top,rht,bot,lft)):
-                brdmsk = itr.border_mask
-                # need to switch the bits around if the edge is top or lft
-                # why?  because the top edge is another tile's bottom, 
-                # which, due to the encoding scheme, is backwards
-                # This only applies to the top and left because of the order
-                # of iteration through the edge list
-                if n == 0 or n == 3:
-                    if brdmsk == 1:
-                        brdmsk = 2
-                    elif brdmsk == 2:
-                        brdmsk = 1
-                bpm |= 0 if brdmsk is None else brdmsk << ( 2*n )
-                sflgs |= 1<<n if itr.sflgs is None else itr.sflgs << n
-                eid |= itr.eid << n
-            return TileElement(bpm, eid, sflgs, None)
-        def update_edges(top: TileEdge, lft: TileEdge, bot: TileEdge, rht: TileEdge, tile):
-            result = []
-            for e, side in zip((top, lft, bot, rht), (TileSide.TOP, TileSide.LFT, TileSide.BOT, TileSide.RHT)):
-                e.eid = tile.edge_id(side)
-                e.border_mask = tile.border_id(side)
-                e.sflgs = tile.ignore_border_flag(side)
-                result.append(e)
-            return result
+        to_TileElement = MapMaker._constraint_tile
+        sampler = self._sampler
+        def pinned(tile, side: TileSide):
+            return tile.border_id(side), tile.ignore_border_flag(side)
 
         for row in range(0, self.height):
             for col in range(0, self.width):
-                # grab our four edges
-                top, tid = find_edge(edges, (col,row), (col+1,row))
-                lft, lid = find_edge(edges, (col,row),(col,row+1))
-                bot, bid = find_edge(edges, (col,row+1), (col+1,row+1))
-                rht, rid = find_edge(edges, (col+1,row),(col+1,row+1))
-                tile_to_find = to_TileElement(top, lft, bot, rht)
+                tile_to_find = to_TileElement(eids[row][col], hborder[row][col], vborder[row][col+1], hborder[row+1][col], vborder[row][col])
                 candidates = self.tile_set.find_tile(tile_to_find)
-                tile_found = candidates[self._help_pick_idx(candidates)]
-                thismap[row*self.width + col] = MapPixel(location_xy=(col,row), element=tile_found)
+                if trace is not None:
+                    trace.placed(len(candidates))
+                    if not candidates:
+                        trace.ran_out(col, row)
+                if sampler is not None:
+                    idx = sampler.pick(tile_to_find)
+                    if idx is None:
+                        if trace is not None and candidates:
+                            trace.ran_out(col, row)
+                        raise RuntimeError(f"no tile left in the inventory for cell {(col, row)}")
+                    sampler.take(idx)
+                    tile_found = self.tile_set.tiles[idx]
+                else:
+                    tile_found = candidates[self._help_pick_idx(candidates)]
+                thismap[row, col] = self.tile_set.tile_index(tile_found)
                 # once we find our tile, update the edges with it's constraints, 
                 # namely, border mask and special flags
-                edges[tid], edges[lid], edges[bid], edges[rid] = update_edges(top,lft,bot,rht,tile_found)
+                hborder[row][col] = pinned(tile_found, TileSide.TOP)
+                vborder[row][col+1] = pinned(tile_found, TileSide.RHT)
+                hborder[row+1][col] = pinned(tile_found, TileSide.BOT)
+                vborder[row][col] = pinned(tile_found, TileSide.LFT)
         
         return thismap
 
+    def _propagating_map(self, eids):
+        '''
+        Same job as _the_real_random_map, but as a constraint solver instead of a greedy scan.
+
+        Every cell keeps a domain, a bitset over tile set indices, starting as the tiles
+        whose edge mask fits the cell's verticies.  Picking a tile for a cell narrows its
+        neighbours' domains to tiles whose borders agree across the shared edge, and that
+        narrowing is propagated until nothing changes.  The undecided cell with the smallest
+        domain gets decided next.  If some domain empties out, the most recent decisions are
+        undone one at a time (excluding the tile that was tried) until things are
+        consistent again, up to max_backtracks in total.
+
+        With an inventory, a cell takes its piece as soon as every tile left in its domain
+        is a side of that one piece, however it got there, and gives it back when that's
+        undone.  A piece that runs out comes off every domain still open, so propagation
+        keeps to the counts.
+        '''
+        by_edge, side_groups, side_compat = self.tile_set.solver_tables()
+        width, height = self.width, self.height
+        trace = self.trace
+        sampler = self._sampler
+        flat_eids = eids.ravel().tolist()
+
+        domains = []
+        for idx, eid in enumerate(flat_eids):
+            if by_edge[eid] == 0:
+                if trace is not None:
+                    trace.ran_out(idx % width, idx // width)
+                raise RuntimeError(f"tile set has no tile with edge mask {eid:04b} for cell {(idx % width, idx // width)}")
+            domains.append(by_edge[eid])
+
+        # cells on the rim also have to fit any boundary tiles
+        if self.boundary is not None:
+            top, rht, bot, lft = self._boundary_pins()
+            rim = set(range(0, width)) | set(range((height-1)*width, height*width))
+            rim |= set(range(0, height*width, width)) | set(range(width-1, height*width, width))
+            for idx in sorted(rim):
+                col, row = idx % width, idx // width
+                outer = (top[col] if row == 0 else None, rht[row] if col == width-1 else None,
+                         bot[col] if row == height-1 else None, lft[row] if col == 0 else None)
+                if outer == (None, None, None, None):
+                    continue
+                allowed = 0
+                for tile in self.tile_set.find_tile(self._constraint_tile(int(eids[row, col]), *outer)):
+                    allowed |= 1 << self.tile_set.tile_index(tile)
+                domains[idx] &= allowed
+                if domains[idx] == 0:
+                    if trace is not None:
+                        trace.ran_out(col, row)
+                    raise RuntimeError(f"no tile fits the boundary at cell {(col, row)}")
+
+        counted = sampler is not None and self.tile_set.has_inventory()
+        if counted:
+            piece_of = self.tile_set.inventory()[0]
+            piece_tiles = [0]*len(sampler.remaining) # bitset of each piece's tiles
+            for tidx, piece in enumerate(piece_of):
+                piece_tiles[piece] |= 1 << tidx
+        exhausted = [] # pieces that just ran out, still to come off the open domains
+        held = [None]*len(domains) # a tile of the piece each cell has taken, None while it's open
+
+        def sole_piece(dom):
+            # a tile of the one piece every tile in dom is a side of, None if there's more than one
+            tidx = (dom & -dom).bit_length() - 1
+            return tidx if dom & ~piece_tiles[piece_of[tidx]] == 0 else None
+
+        def neighbours(idx):
+            # (neighbour index, side of idx it's on), in TileSide order
+            col, row = idx % width, idx // width
+            for side, (ncol, nrow) in enumerate(get_4adj_neighbors((col, row))):
+                if 0 <= ncol < width and 0 <= nrow < height:
+                    yield nrow*width + ncol, side
+
+        trail = [] # (cell, domain before it was narrowed, whether that took a piece), for undoing
+        heap = [(d.bit_count(), idx) for idx, d in enumerate(domains)]
+        heapq.heapify(heap)
+
+        def narrow(idx, dom):
+            # every domain change goes through here, so it can be undone; dom isn't 0
+            tidx = sole_piece(dom) if counted and held[idx] is None else None
+            if tidx is not None:
+                if not sampler.available(tidx):
+                    return False
+                sampler.take(tidx)
+                held[idx] = tidx
+                if not sampler.available(tidx):
+                    exhausted.append(piece_of[tidx])
+            trail.append((idx, domains[idx], tidx is not None))
+            domains[idx] = dom
+            heapq.heappush(heap, (dom.bit_count(), idx))
+            return True
+
+        def run_out(pending):
+            # take the pieces that just ran out off every domain still open
+            while exhausted:
+                tiles = piece_tiles[exhausted.pop()]
+                for idx, dom in enumerate(domains):
+                    if dom & tiles and held[idx] is None:
+                        narrowed = dom & ~tiles
+                        if narrowed == 0 or not narrow(idx, narrowed):
+                            if trace is not None:
+                                trace.ran_out(idx % width, idx // width)
+                            return False
+                        pending.append(idx)
+            return True
+
+        def propagate(pending):
+            while True:
+                if exhausted and not run_out(pending):
+                    return False
+                if not pending:
+                    return True
+                idx = pending.pop()
+                dom = domains[idx]
+                for nidx, side in neighbours(idx):
+                    # anything a tile still possible here allows on that side
+                    allowed = 0
+                    for members, compat in zip(side_groups[side], side_compat[side]):
+                        if dom & members:
+                            allowed |= compat
+                    narrowed = domains[nidx] & allowed
+                    if narrowed != domains[nidx]:
+                        if narrowed == 0 or not narrow(nidx, narrowed):
+                            if trace is not None:
+                                trace.ran_out(nidx % width, nidx // width)
+                            return False
+                        pending.append(nidx)
+
+        def undo(trail_len):
+            # back to a consistent state, whose run out pieces are already off every domain
+            exhausted.clear()
+            while len(trail) > trail_len:
+                idx, dom, took = trail.pop()
+                if took:
+                    sampler.give_back(held[idx])
+                    held[idx] = None
+                domains[idx] = dom
+                heapq.heappush(heap, (dom.bit_count(), idx))
+
+        if counted:
+            # cells only one piece fits take it for good, and pieces there are none of come off everything
+            exhausted.extend(piece for piece, left in enumerate(sampler.remaining) if left is not None and left <= 0)
+            for idx, dom in enumerate(domains):
+                tidx = sole_piece(dom)
+                if tidx is not None:
+                    if not sampler.available(tidx):
+                        if trace is not None:
+                            trace.ran_out(idx % width, idx // width)
+                        raise RuntimeError(f"no tile left in the inventory for cell {(idx % width, idx // width)}")
+                    sampler.take(tidx)
+                    held[idx] = tidx
+                    if not sampler.available(tidx):
+                        exhausted.append(piece_of[tidx])
+
+        decisions = [] # (trail length before, cell, chosen tile bit)
+        backtracks = 0
+        choices = [1]*len(domains) # candidates each cell had when it was decided, for the trace
+        consistent = propagate(list(range(0, len(domains))))
+        while True:
+            while not consistent:
+                if not decisions or backtracks >= self.max_backtracks:
+                    raise RuntimeError(f"no consistent tiling found after {backtracks} backtracks")
+                trail_len, idx, bit = decisions.pop()
+                undo(trail_len)
+                backtracks += 1
+                # that tile didn't work out here, so take it off the table and carry on
+                narrowed = domains[idx] & ~bit
+                consistent = narrowed != 0 and narrow(idx, narrowed) and propagate([idx])
+
+            # lowest entropy undecided cell, skipping stale heap entries
+            idx = None
+            while heap:
+                count, cand = heapq.heappop(heap)
+                if count > 1 and domains[cand].bit_count() == count:
+                    idx = cand
+                    break
+            if idx is None:
+                break
+
+            dom = domains[idx]
+            choices[idx] = dom.bit_count()
+            if sampler is not None:
+                bit = sampler.pick_bit(dom, flat_eids[idx], held[idx] is not None)
+                if bit == 0:
+                    # every tile that could go here has run out, so it's a dead end like any other
+                    heapq.heappush(heap, (dom.bit_count(), idx))
+                    consistent = False
+                    continue
+            else:
+                choice = self._help_pick_idx(range(0, dom.bit_count()))
+                for _ in range(0, choice):
+                    dom &= dom - 1 # drop lowest set bit
+                bit = dom & -dom
+            decisions.append((len(trail), idx, bit))
+            consistent = narrow(idx, bit) and propagate([idx])
+
+        if trace is not None:
+            for count in choices:
+                trace.placed(count)
+        thismap = self._init_map()
+        thismap.ravel()[:] = [dom.bit_length() - 1 for dom in domains]
+        return thismap
+
+    def _strip_map(self):
+        '''
+        The board cut into self.strips strips of rows, matched in parallel worker processes.
+
+        Each strip is first matched on its own, by self.solver.  Border lines carry on
+        through the tiles, so two strips won't generally agree where they meet, and
+        pinning the seams down first doesn't help: a strip caught between two of them
+        usually has no tiling at all.  So each seam is matched again afterwards, as a band
+        of STRIP_SEAM_ROWS rows either side of it solved by the propagating solver against
+        the rows just outside the band, which makes every edge and border across it fit
+        just as in one pass.  The few bands that can't be made to fit get widened and
+        retried here, at worst out to the whole board.
+
+        Every piece gets its own seed drawn from `random`, so the map depends on the seed
+        and the strip count, but not on how many workers there are.
+
+        With an inventory, every piece is matched against what the rest of the board has
+        left of it, so they're matched one after another, here, instead of in parallel.
+        '''
+        from concurrent.futures import ProcessPoolExecutor
+        reach = STRIP_SEAM_ROWS
+        strips = min(self.strips, self.height // (2*reach + 1)) # seam bands mustn't touch
+        cuts = [round(k*self.height/strips) for k in range(0, strips+1)]
+        grid = self._init_map()
+
+        def bounds(start, stop):
+            above = grid[start-1].tolist() if start > 0 else None
+            below = grid[stop].tolist() if stop < self.height else None
+            return above, below
+
+        counted = self.tile_set.has_inventory()
+        def left_for(start, stop):
+            # with an inventory, what the rows outside start to stop leave of it
+            if not counted:
+                return None
+            counts = self._inventory_counts()
+            left = counts - self.tile_set.inventory_used(np.concatenate((grid[:start], grid[stop:])))
+            return [None if count < 0 else int(n) for count, n in zip(counts.tolist(), left.tolist())]
+
+        traced = self.trace is not None
+        def solve_all(pool, jobs, solver, bounded):
+            # (start, stop, (grid, trace) or the error) for each job, in order
+            if counted:
+                for start, stop, seed in jobs:
+                    random.seed(seed)
+                    try:
+                        yield start, stop, _match_strip(self.tile_set, self._vertices[start:stop+1], *(bounds(start, stop) if bounded else (None, None)),
+                                                        solver, self.max_backtracks, traced, left_for(start, stop))
+                    except (RuntimeError, ValueError) as err:
+                        yield start, stop, err
+                return
+            futures = [pool.submit(_solve_strip, self._vertices[start:stop+1], *(bounds(start, stop) if bounded else (None, None)), solver,
+                                   self.max_backtracks, seed, traced)
+                       for start, stop, seed in jobs]
+            for (start, stop, _), future in zip(jobs, futures):
+                try:
+                    yield start, stop, future.result()
+                except (RuntimeError, ValueError) as err:
+                    yield start, stop, err
+
+        widen = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_strip_worker, initargs=(self.tile_set,)) as pool:
+            strip_jobs = [(cuts[k], cuts[k+1], random.getrandbits(64)) for k in range(0, strips)]
+            for start, stop, result in solve_all(pool, strip_jobs, self.solver, False):
+                if isinstance(result, Exception):
+                    # ValueError is the greedy solver running out of candidates
+                    raise RuntimeError(f"rows {start} to {stop-1}: {result}") from result
+                grid[start:stop], sub = result
+                self._merge_trace(sub, start)
+
+            seam_jobs = [(cut-reach, cut+reach, random.getrandbits(64)) for cut in cuts[1:-1]]
+            for start, stop, result in solve_all(pool, seam_jobs, "propagate", True):
+                if isinstance(result, Exception):
+                    widen.append((start, stop))
+                    continue
+                grid[start:stop], sub = result
+                self._merge_trace(sub, start)
+
+        for start, stop in widen:
+            while True:
+                start, stop = max(0, start-reach), min(self.height, stop+reach)
+                try:
+                    grid[start:stop], sub = _match_strip(self.tile_set, self._vertices[start:stop+1], *bounds(start, stop),
+                                                         "propagate", self.max_backtracks, traced, left_for(start, stop))
+                except RuntimeError:
+                    if start == 0 and stop == self.height:
+                        raise
+                    continue
+                self._merge_trace(sub, start)
+                break
+        return grid
+
+    def _merge_trace(self, sub, row_offset):
+        # fold the matching stats of a piece of the board, starting at row_offset, into ours
+        # (cells a seam band matches again get counted again)
+        if self.trace is None or sub is None:
+            return
+        for count, cells in sub.candidates.items():
+            self.trace.candidates[count] = self.trace.candidates.get(count, 0) + cells
+        for col, row in sub.empty_candidates:
+            self.trace.ran_out(col, row + row_offset)
+
     def _help_pick_idx(self, listing):
         return random.randint(0, len(listing)-1)
 
     '''
     returns an image of the full map
+    scale or target_px_per_tile draw it smaller (or bigger), see TileSet.scaled_tile_wh;
+    a thumbnail only costs about as much as its own pixels
     '''
-    def render(self):
-        img = self.tile_set.create_numpy_array_for_tile_map(self.width, self.height)
-        for pix in self._map:
-            x, y = pix.location_xy
-            if pix.element is None:
-                pix.element = TileElement(0b0000,0b0000,0b0000,None)
-            img = self.tile_set.insert_tile(img, x, y, pix.element)
+    def render(self, scale=None, target_px_per_tile=None):
+        with self._phase("render"):
+            tile_wh = self.tile_set.scaled_tile_wh(scale, target_px_per_tile)
+            img = self.tile_set.render_tile_grid(self.tile_grid, tile_wh=tile_wh)
+        self._image, self._image_tile_wh = img, tile_wh
         return img
 
+    def reroll(self, rect, strategy=None):
+        '''
+        Make part of the map over, leaving the rest of it alone.
+
+        rect : (col, row, width, height) of the cells to redo
+        strategy : vertex strategy for the new layout.  Default is the map's own
+
+        Only the verticies strictly inside rect get laid out again, so its outline, and
+        every tile outside it, stay put; the cells inside are solved against the tiles
+        around them (always by the propagating solver, as they're boxed in on every
+        side).  If no tiling fits, the verticies are laid out again, up to REROLL_TRIES
+        times, before giving up with a RuntimeError.
+
+        If the map has been render()ed, that image is patched in place, redrawing just
+        the rect.  returns that image, or None if there isn't one.
+        Costs scale with the size of rect, not the board.
+        '''
+        col, row, width, height = rect
+        if width < 1 or height < 1 or col < 0 or row < 0 or col+width > self.width or row+height > self.height:
+            raise ValueError(f"{rect} isn't a rectangle of cells on a {self.width}x{self.height} map")
+        with self._phase("reroll"):
+            def outside(cells):
+                return [None if not (0 <= x < self.width and 0 <= y < self.height) else self.tile_at(x, y)
+                        for x, y in cells]
+            boundary = (outside([(x, row-1) for x in range(col, col+width)]),
+                        outside([(col+width, y) for y in range(row, row+height)]),
+                        outside([(x, row+height) for x in range(col, col+width)]),
+                        outside([(col-1, y) for y in range(row, row+height)]))
+            vertices = self._vertices[row:row+height+1, col:col+width+1].copy()
+            layout = VERTEX_STRATEGIES[strategy if strategy is not None else self.strategy]
+            inventory = None
+            if self.tile_set.has_inventory():
+                if self._pieces_used is None:
+                    # a loaded map; counted once, and kept up to date from here on
+                    self._pieces_used = self.tile_set.inventory_used(self.tile_grid)
+                # whatever the rest of the map isn't using
+                inside_used = self.tile_set.inventory_used(self.tile_grid[row:row+height, col:col+width])
+                counts = self._inventory_counts()
+                left = counts - (self._pieces_used - inside_used)
+                inventory = [None if count < 0 else int(n) for count, n in zip(counts.tolist(), left.tolist())]
+            for attempt in range(0, REROLL_TRIES):
+                rng = np.random.default_rng(random.getrandbits(64))
+                vertices[1:-1, 1:-1] = layout(width, height, rng)[1:-1, 1:-1]
+                try:
+                    patch = MapMaker(self.tile_set, (width, height), solver="propagate", max_backtracks=self.max_backtracks,
+                                     vertices=vertices, boundary=boundary, inventory=inventory)
+                    break
+                except RuntimeError:
+                    if attempt == REROLL_TRIES-1:
+                        raise
+            self._vertices[row:row+height+1, col:col+width+1] = vertices
+            self.tile_grid[row:row+height, col:col+width] = patch.tile_grid
+            if inventory is not None:
+                self._pieces_used += self.tile_set.inventory_used(patch.tile_grid) - inside_used
+            self.rerolls.append(list(rect))
+
+            if self._image is None:
+                return None
+            tile_width, tile_height = self._image_tile_wh
+            self._image[row*tile_height:(row+height)*tile_height, col*tile_width:(col+width)*tile_width] = \
+                self.tile_set.render_tile_grid(patch.tile_grid, tile_wh=self._image_tile_wh)
+        return self._image
+
+    def render_rows(self, scale=None, target_px_per_tile=None):
+        '''
+        Same image as render(), handed out one row of tiles at a time as
+        (tile_height, full_width, channels) bands, so only one band is ever alive
+        '''
+        tile_wh = self.tile_set.scaled_tile_wh(scale, target_px_per_tile)
+        for row in range(0, self.height):
+            yield self.tile_set.render_tile_row(self.tile_grid[row], tile_wh=tile_wh)
+
+    def render_to_file(self, filename, scale=None, target_px_per_tile=None):
+        '''
+        Stream the image straight to disk, without ever holding the full board in memory.
+        .png is written as a row-streamed PNG; .npy is written through a memory-mapped array.
+        '''
+        with self._phase("render"):
+            self._render_to_file(filename, scale, target_px_per_tile)
+
+    def _render_to_file(self, filename, scale, target_px_per_tile):
+        tile_width, tile_height = self.tile_set.scaled_tile_wh(scale, target_px_per_tile)
+        full_width = self.width * tile_width
+        full_height = self.height * tile_height
+        rows = self.render_rows(scale, target_px_per_tile)
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == ".npy":
+            out = np.lib.format.open_memmap(filename, mode='w+', dtype=self.tile_set.tile_dtype,
+                                            shape=(full_height, full_width, self.tile_set.tile_channels))
+            for row, band in enumerate(rows):
+                ys = row*tile_height
+                out[ys:ys+band.shape[0]] = band
+                out.flush()
+            del out
+        elif ext == ".png":
+            with PngStreamWriter(filename, full_width, full_height) as out:
+                for band in rows:
+                    out.write_rows(band)
+        else:
+            raise ValueError(f"don't know how to stream {ext} files, use .png or .npy")
+
+    def tile_at(self, x, y):
+        return self.tile_set.tiles[self.tile_grid[y, x]]
+
+    def pixels(self):
+        '''
+        The map as a list of MapPixel, row by row
+        '''
+        tiles = self.tile_set.tiles
+        return [MapPixel(location_xy=(idx % self.width, idx // self.width), element=tiles[tile])
+                for idx, tile in enumerate(self.tile_grid.ravel().tolist())]
+
+    '''
+    Saving maps: a few KB of .npz instead of a rendered image.  Holds the tile index and
+    vertex grids, plus a JSON "meta" string with the size, strategy, solver, seed and the
+    fingerprint of the tile set the indices refer to.
+    '''
+    def save(self, filename):
+        # filename may also be a file object
+        meta = {
+            "version": MAP_FILE_VERSION,
+            "width": self.width,
+            "height": self.height,
+            "strategy": self.strategy,
+            "solver": self.solver,
+            "seed": self.seed,
+            "rerolls": self.rerolls,
+            "tileset": os.path.basename(self.tile_set.json_file),
+            "tileset_hash": self.tile_set.fingerprint(),
+            "tileset_tiles": len(self.tile_set.tiles),
+            "tileset_rotations": self.tile_set.has_rotations(),
+        }
+        arrays = {"tiles": self.tile_grid, "vertices": self._vertices, "meta": np.array(json.dumps(meta))}
+        if hasattr(filename, "write"):
+            np.savez_compressed(filename, **arrays)
+        else:
+            # through a file object, as handed a name numpy would tack .npz on to it
+            with open(filename, 'wb') as fid:
+                np.savez_compressed(fid, **arrays)
+        return filename
+
+    @staticmethod
+    def read_map_file(filename):
+        '''
+        returns (meta dict, tile index grid, vertex grid) from a save()d map
+        '''
+        with np.load(filename) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != MAP_FILE_VERSION:
+                raise ValueError(f"{filename} is a version {meta['version']} map file, expected {MAP_FILE_VERSION}")
+            return meta, data["tiles"], data["vertices"]
+
+    @classmethod
+    def load(cls, filename, tile_set, trace=None):
+        '''
+        A save()d map, ready to render() or reroll() without solving it again.
+        tile_set has to be the one it was made with (its fingerprint is checked).
+        '''
+        meta, tile_grid, vertices = cls.read_map_file(filename)
+        if meta["tileset_hash"] != tile_set.fingerprint():
+            # maps saved before these were recorded only have the hash to go on
+            rotations = meta.get("tileset_rotations")
+            if rotations is not None and rotations != tile_set.has_rotations():
+                made, loaded = ("with", "without") if rotations else ("without", "with")
+                raise ValueError(f"map was saved {made} --rotate (rotations=True), but {tile_set.json_file} was loaded {loaded}")
+            tiles = meta.get("tileset_tiles")
+            raise ValueError(f"map was made with a different tile set ({meta['tileset']}{'' if tiles is None else f', {tiles} tiles'}) "
+                             f"than {tile_set.json_file} ({len(tile_set.tiles)} tiles)")
+        result = cls(tile_set, (meta["width"], meta["height"]), strategy=meta["strategy"], solver=meta["solver"],
+                     vertices=vertices, trace=trace, tile_grid=tile_grid)
+        result.seed = meta["seed"]
+        result.rerolls = meta["rerolls"]
+        return result
+
 def run_tests():
+    import matplotlib.pyplot as plt
     record_file = "./tile_recordsmodded.json"
     tile_set = TileSet(my_json_file=record_file)
 
@@ -507,6 +1997,224 @@ def run_tests():
     plt.show()
 
 
+# ================================================================================= #
+#                         ____        _       _     
+#                        | __ )  __ _| |_ ___| |__  
+#                        |  _ \ / _` | __/ __| '_ \ 
+#                        | |_) | (_| | || (__| | | |
+#                        |____/ \__,_|\__\___|_| |_|
+#
+# ================================================================================= #
+_batch_tileset = None # each worker process loads the tile set once, here
+
+def _init_batch_worker(tileset_file, rotations=False):
+    global _batch_tileset
+    _batch_tileset = TileSet(my_json_file=tileset_file, rotations=rotations)
+
+def _generate_batch_map(seed, map_wh, strategy, solver, outdir, scale=None, images=True, search=None):
+    '''
+    Make and save one map.  Writes the map itself as map_<seed>.npz (see MapMaker.save),
+    its image as map_<seed>.png unless not images, and a map_<seed>.json sidecar
+    describing it (with search, its search_maps stats, if any), and returns the sidecar contents.
+    '''
+    name = os.path.join(outdir, f"map_{seed}")
+    record = {"seed": seed, "width": map_wh[0], "height": map_wh[1], "strategy": strategy, "solver": solver,
+              "tileset": _batch_tileset.json_file, "scale": scale, "map": None, "image": None, "error": None, "timings": {}}
+    if search is not None:
+        record["search"] = search
+    timings = record["timings"]
+    trace = MapTrace()
+    try:
+        start = time.perf_counter()
+        maker = MapMaker(_batch_tileset, map_wh, strategy=strategy, solver=solver, trace=trace, seed=seed)
+        timings["generate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        maker.save(name + ".npz")
+        timings["save_map"] = time.perf_counter() - start
+        record["map"] = os.path.basename(name) + ".npz"
+
+        if images:
+            start = time.perf_counter()
+            img = maker.render(scale=scale)
+            timings["render"] = time.perf_counter() - start
+
+            from PIL import Image
+            start = time.perf_counter()
+            Image.fromarray(img).save(name + ".png")
+            timings["save"] = time.perf_counter() - start
+            record["image"] = os.path.basename(name) + ".png"
+    except Exception as err:
+        # one bad roll shouldn't take the whole batch down with it
+        record["error"] = f"{type(err).__name__}: {err}"
+        if search is not None and "generate" not in timings:
+            # a search candidate that won't tile is passed over for the next one (see run_batch), so leave no sidecar
+            return record
+    record["trace"] = trace.to_dict()
+    with open(name + ".json", 'w') as fid:
+        json.dump(record, fid, indent=4)
+    return record
+
+_strip_tileset = None # likewise for MapMaker strips, handed over from the parent process
+
+def _init_strip_worker(tile_set):
+    global _strip_tileset
+    _strip_tileset = tile_set
+
+def _solve_strip(vertices, above, below, solver, max_backtracks, seed, traced):
+    random.seed(seed)
+    return _match_strip(_strip_tileset, vertices, above, below, solver, max_backtracks, traced)
+
+def _match_strip(tile_set, vertices, above, below, solver, max_backtracks, traced, inventory=None):
+    '''
+    Match one strip of a MapMaker(strips=...) board against the rows of tiles either side
+    of it, given as tile indices (None for nothing there), and out of inventory if given.
+    returns the strip's grid of tile indices, and its MapTrace if traced
+    '''
+    tiles = tile_set.tiles
+    height, width = vertices.shape[0]-1, vertices.shape[1]-1
+    boundary = ([tiles[idx] for idx in above] if above is not None else None, None,
+                [tiles[idx] for idx in below] if below is not None else None, None)
+    trace = MapTrace() if traced else None
+    maker = MapMaker(tile_set, (width, height), solver=solver, max_backtracks=max_backtracks,
+                     vertices=vertices, trace=trace, boundary=boundary, inventory=inventory)
+    return maker.tile_grid, trace
+
+def run_batch(tileset_file, map_wh, count, base_seed, outdir, strategy="parceled", solver="greedy", workers=None, scale=None, images=True, rotations=False,
+              searched=None):
+    '''
+    Generate count maps headless, seeded base_seed, base_seed+1, ..., spread over a process pool.
+    searched : optional ranked (seed, stats) list from search_maps, to make the best count of
+        those instead.  Like best_of_n, a candidate the solver can't tile is passed over for
+        the next best
+    returns the list of sidecar records, in seed order (or searched order, without the
+    candidates passed over)
+    '''
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    os.makedirs(outdir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(tileset_file, rotations)) as pool:
+        if searched is None:
+            futures = [pool.submit(_generate_batch_map, seed, map_wh, strategy, solver, outdir, scale, images) for seed in range(base_seed, base_seed + count)]
+            return [f.result() for f in futures]
+
+        # count candidates in flight at a time, each one that won't tile making way for the next in line
+        candidates = enumerate(searched)
+        ranks = {} # future -> rank of its candidate
+        def submit(rank, seed, stats):
+            future = pool.submit(_generate_batch_map, seed, map_wh, strategy, solver, outdir, scale, images, stats)
+            ranks[future] = rank
+            return future
+        pending = {submit(rank, seed, stats) for rank, (seed, stats) in itertools.islice(candidates, count)}
+        made = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                if record["error"] is not None and "generate" not in record["timings"]:
+                    following = next(candidates, None)
+                    if following is not None:
+                        rank, (seed, stats) = following
+                        pending.add(submit(rank, seed, stats))
+                    continue
+                made.append((ranks[future], record))
+        return [record for _, record in sorted(made, key=lambda m: m[0])]
+
+# ================================================================================= #
+#                    ____                      _
+#                   / ___|  ___  __ _ _ __ ___| |__
+#                   \___ \ / _ \/ _` | '__/ __| '_ \
+#                    ___) |  __/ (_| | | | (__| | | |
+#                   |____/ \___|\__,_|_|  \___|_| |_|
+#
+# ================================================================================= #
+def vertex_grid_stats(grids):
+    '''
+    Land metrics of a stack of vertex grids, scored all at once.
+    grids : (n, height+1, width+1) grids of 0/1 verticies
+    returns a dict of length n arrays
+      land       : fraction of the verticies that are land
+      continents : number of land masses, verticies joined up/down/left/right the way
+                   land edges join them
+      smallest   : verticies in the smallest land mass, 0 with no land
+      largest    : verticies in the largest land mass, 0 with no land
+    '''
+    from skimage.measure import label
+    grids = np.asarray(grids, dtype=np.uint8)
+    n, rows, cols = grids.shape
+    # lay the grids side by side with an ocean column between, so one labelling pass does the lot
+    side_by_side = np.zeros((rows, n, cols+1), dtype=np.uint8)
+    side_by_side[:, :, :cols] = grids.transpose(1, 0, 2)
+    labels = label(side_by_side.reshape(rows, n*(cols+1)), connectivity=1).reshape(rows, n, cols+1)
+    land = labels > 0
+    sizes = np.bincount(labels[land])
+    owner = np.zeros(len(sizes), dtype=np.intp) # which grid each label is in
+    owner[labels[land]] = np.broadcast_to(np.arange(n)[None, :, None], labels.shape)[land]
+    sizes, owner = sizes[1:], owner[1:]
+    smallest = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(smallest, owner, sizes)
+    largest = np.zeros(n, dtype=np.int64)
+    np.maximum.at(largest, owner, sizes)
+    continents = np.bincount(owner, minlength=n)
+    return {
+        "land": grids.reshape(n, -1).mean(axis=1),
+        "continents": continents,
+        "smallest": np.where(continents > 0, smallest, 0),
+        "largest": largest,
+    }
+
+def search_maps(map_wh, count, base_seed, strategy="parceled", land=None, land_tolerance=0.05, continents=None, min_island=None):
+    '''
+    Rolls the vertex grids of count maps, seeded base_seed, base_seed+1, ..., exactly as
+    MapMaker(seed=...) would, and throws out the ones that miss before any tile matching.
+      land        : target land fraction, met within land_tolerance
+      continents  : (fewest, most) land masses, either may be None
+      min_island  : any land mass of fewer verticies rejects the grid
+    returns (seed, stats) of every grid that passed, best first: closest to the land
+    target, then in seed order.  stats are as vertex_grid_stats, for that one grid.
+    '''
+    width, height = map_wh
+    fewest, most = continents if continents is not None else (None, None)
+    passed = []
+    for start in range(base_seed, base_seed + count, SEARCH_BATCH):
+        seeds = np.arange(start, min(start + SEARCH_BATCH, base_seed + count))
+        # the same draws MapMaker(seed=seed) makes for its strategy, without touching `random` itself
+        grids = np.stack([VERTEX_STRATEGIES[strategy](width, height, np.random.default_rng(random.Random(int(seed)).getrandbits(64)))
+                          for seed in seeds])
+        stats = vertex_grid_stats(grids)
+        ok = np.ones(len(seeds), dtype=bool)
+        if land is not None:
+            ok &= np.abs(stats["land"] - land) <= land_tolerance
+        if fewest is not None:
+            ok &= stats["continents"] >= fewest
+        if most is not None:
+            ok &= stats["continents"] <= most
+        if min_island is not None:
+            ok &= (stats["continents"] == 0) | (stats["smallest"] >= min_island)
+        for idx in np.flatnonzero(ok):
+            passed.append((int(seeds[idx]), {key: value[idx].item() for key, value in stats.items()}))
+    if land is not None:
+        passed.sort(key=lambda item: (abs(item[1]["land"] - land), item[0]))
+    return passed
+
+def best_of_n(tile_set, map_wh, count, base_seed, keep=1, strategy="parceled", solver="greedy", trace=None, **criteria):
+    '''
+    Monte Carlo map search: scores count candidate vertex grids with search_maps(**criteria)
+    and only matches tiles for the best keep of them.  A candidate the solver can't tile
+    is passed over for the next best.  Each kept map is remade from its seed, so it is
+    the very map --seed gives.
+    returns list of (MapMaker, stats), best first, and how many candidates passed
+    '''
+    ranked = search_maps(map_wh, count, base_seed, strategy, **criteria)
+    kept = []
+    for seed, stats in ranked:
+        if len(kept) >= keep:
+            break
+        try:
+            kept.append((MapMaker(tile_set, map_wh, strategy=strategy, solver=solver, trace=trace, seed=seed), stats))
+        except (RuntimeError, ValueError):
+            continue
+    return kept, len(ranked)
+
 # ================================================================================= #
 #         __  __       _         ____            _                     
 #        |  \/  | __ _(_)_ __   | __ ) _   _ ___(_)_ __   ___  ___ ___ 
@@ -521,18 +2229,110 @@ if __name__ == "__main__":
     else:
         MAXTRIES = 1
         parser = argparse.ArgumentParser(description="Make a map for Civ III, the Boardgame!")
-        parser.add_argument("TILESET", type=str, help=".json of the tile set to use")
-        parser.add_argument("WIDTH", type=int, help="Map width, in tiles")
-        parser.add_argument("HEIGHT", type=int, help="Map height, in tiles")
+        parser.add_argument("TILESET", type=str, help=".json of the tile set to use, or one compiled by tools/compile_tileset.py")
+        parser.add_argument("WIDTH", type=int, nargs="?", help="Map width, in tiles.  Not needed with --load")
+        parser.add_argument("HEIGHT", type=int, nargs="?", help="Map height, in tiles.  Not needed with --load")
+        parser.add_argument("--rotate", action="store_true", help="Also use every tile turned CW, CCW and 180, for the unique tile sets (not the 'modded' ones)")
+        parser.add_argument("--strategy", type=str, default="parceled", choices=sorted(VERTEX_STRATEGIES), help="Continent layout strategy.  Default is 'parceled'")
+        parser.add_argument("--solver", type=str, default="greedy", choices=sorted(MapMaker.SOLVERS), help="Tile placement.  'propagate' backtracks instead of failing on dead ends.  Default is 'greedy'")
+        parser.add_argument("--seed", type=int, default=None, help="RNG seed.  For batches, the seed of the first map")
+        parser.add_argument("--output", type=str, default=None, help="Stream the map straight to this .png or .npy file instead of showing a plot")
+        parser.add_argument("--scale", type=float, default=None, help="Draw the map at this fraction of full tile size, e.g. 0.1 for a thumbnail")
+        parser.add_argument("--reroll", type=int, nargs=4, action="append", default=[], metavar=("COL", "ROW", "W", "H"),
+                            help="Make this rectangle of cells over, keeping the rest of the map.  May be given more than once")
+        parser.add_argument("--reroll-seed", type=int, default=None, help="RNG seed for --reroll, to try other versions of a region of the same map")
+        parser.add_argument("--save", type=str, default=None, help="Also save the map itself (a few KB of .npz) here, to --load later")
+        parser.add_argument("--load", type=str, default=None, help="Load this saved map instead of making a new one, to render or --reroll it")
+        parser.add_argument("--no-images", action="store_true", help="Batch mode: only save the maps (.npz), don't render PNGs")
+        parser.add_argument("--trace", type=str, default=None, help="Write a .json trace of phase timings and matching stats here")
+        parser.add_argument("--outdir", type=str, default=None, help="Batch mode: write PNGs and .json sidecars here instead of showing a plot")
+        parser.add_argument("--count", type=int, default=1, help="Batch mode: number of maps to make.  Default is 1")
+        parser.add_argument("--strips", type=int, default=1, help="Match the map as this many strips of rows in parallel, for very large boards.  Default is 1")
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes, for batch mode or --strips.  Default is one per core")
+        parser.add_argument("--best-of", type=int, default=None, metavar="N",
+                            help="Roll N candidate continent layouts from --seed on, and only match tiles for the best --keep that meet --land, --continents and --min-island")
+        parser.add_argument("--keep", type=int, default=1, help="With --best-of: maps to keep.  More than 1 needs --outdir.  Default is 1")
+        parser.add_argument("--land", type=float, default=None, help="With --best-of: target fraction of land verticies, best maps are closest to it")
+        parser.add_argument("--land-tolerance", type=float, default=0.05, help="With --best-of: how far off --land a map may be.  Default is 0.05")
+        parser.add_argument("--continents", type=int, nargs="+", default=None, metavar=("MIN", "MAX"),
+                            help="With --best-of: number of land masses, exactly MIN or MIN to MAX")
+        parser.add_argument("--min-island", type=int, default=None, help="With --best-of: reject maps with a land mass of fewer verticies than this")
 
         args = parser.parse_args()
 
         MAPW = args.WIDTH
         MAPH = args.HEIGHT
-        tileset = TileSet(my_json_file=args.TILESET)
-        maker = MapMaker(tileset, map_wh=(MAPW, MAPH))
+        if args.load is None and (MAPW is None or MAPH is None):
+            parser.error("WIDTH and HEIGHT are needed, unless using --load")
+        if args.scale is not None and not args.scale > 0:
+            parser.error(f"--scale {args.scale} should be more than 0")
+        if args.outdir is not None:
+            # batch mode makes, saves and renders its own maps, none of these carry over to it
+            for flag, given in (("--load", args.load is not None), ("--output", args.output is not None),
+                                ("--strips", args.strips != 1), ("--reroll", bool(args.reroll)),
+                                ("--trace", args.trace is not None), ("--save", args.save is not None)):
+                if given:
+                    parser.error(f"{flag} can't be used with --outdir")
+        criteria = None
+        if args.best_of is not None:
+            if args.load is not None:
+                parser.error("--best-of makes new maps, it can't be used with --load")
+            if args.keep > 1 and args.outdir is None:
+                parser.error("--keep more than 1 needs --outdir")
+            if args.continents is not None and len(args.continents) > 2:
+                parser.error("--continents takes MIN, or MIN MAX")
+            criteria = {"land": args.land, "land_tolerance": args.land_tolerance, "min_island": args.min_island,
+                        "continents": None if args.continents is None else (args.continents[0], args.continents[-1])}
+        base_seed = args.seed if args.seed is not None else random.randrange(2**31)
+        if args.outdir is not None:
+            searched = None
+            if criteria is not None:
+                searched = search_maps((MAPW, MAPH), args.best_of, base_seed, args.strategy, **criteria)
+                print(f"{len(searched)} of {args.best_of} candidates passed", file=sys.stderr)
+            count = args.keep if criteria is not None else args.count
+            records = run_batch(args.TILESET, (MAPW, MAPH), count, base_seed, args.outdir, args.strategy, args.solver, args.workers, args.scale, not args.no_images, args.rotate,
+                                searched)
+            failed = [r for r in records if r["error"] is not None]
+            for r in failed:
+                print(f"seed {r['seed']} failed: {r['error']}", file=sys.stderr)
+            if len(records) < count:
+                print(f"only {len(records)} of the {len(searched)} candidates that passed would tile", file=sys.stderr)
+            print(f"wrote {len(records) - len(failed)} of {count} maps to {args.outdir}")
+            sys.exit(1 if failed or len(records) < count else 0)
+
+        tileset = TileSet(my_json_file=args.TILESET, rotations=args.rotate)
+        trace = MapTrace() if args.trace is not None else None
+        try:
+            if args.load is not None:
+                maker = MapMaker.load(args.load, tileset, trace=trace)
+            elif criteria is not None:
+                kept, passed = best_of_n(tileset, (MAPW, MAPH), args.best_of, base_seed, 1, args.strategy, args.solver, trace, **criteria)
+                if not kept:
+                    sys.exit(f"none of {args.best_of} candidates from seed {base_seed} made the cut ({passed} passed, but wouldn't tile)")
+                maker, stats = kept[0]
+                print(f"seed {maker.seed}, best of {args.best_of} ({passed} passed): {json.dumps(stats)}", file=sys.stderr)
+            else:
+                maker = MapMaker(tileset, map_wh=(MAPW, MAPH), strategy=args.strategy, solver=args.solver, trace=trace,
+                                 strips=args.strips, workers=args.workers, seed=args.seed)
+            if args.reroll_seed is not None:
+                random.seed(args.reroll_seed)
+            for rect in args.reroll:
+                maker.reroll(rect)
+            if args.save is not None:
+                maker.save(args.save)
+            if args.output is not None:
+                maker.render_to_file(args.output, scale=args.scale)
+            else:
+                img = maker.render(scale=args.scale)
+        finally:
+            # a trace is most useful when things went wrong
+            if trace is not None:
+                trace.to_json(args.trace)
+        if args.output is not None:
+            sys.exit(0)
+        import matplotlib.pyplot as plt
         plt.figure(24511)
-        plt.imshow(maker.render())
+        plt.imshow(img)
         plt.show()
 else:
     pass # explicitly
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+'''
+    A long running map server, so the web app doesn't pay for a fresh process, a tile
+    set parse and a round of tile decoding on every map.
+
+    Tile sets are loaded once, by each of a pool of worker processes, with their tile
+    atlases decoded up front.  Requests come in over a Unix socket (or localhost TCP) as
+    one JSON object per line, and each gets one JSON object per line back, tagged with
+    the request's "id".  Requests on a connection run concurrently, so replies can come
+    back out of order.
+
+        {"op": "ping"}
+        {"op": "tilesets"}
+        {"op": "generate", "tileset": "trimmed-uniquemodded", "width": 13, "height": 9,
+         "strategy": "parceled", "solver": "greedy", "seed": 4, "scale": 0.25,
+         "image": true, "map": false}
+        {"op": "render", "tileset": "trimmed-uniquemodded", "map": "<base64 .npz>", "scale": 0.25}
+
+    generate and render reply with {"id", "ok": true, "seed", "width", "height",
+    "image": base64 PNG, "map": base64 .npz (see MapMaker.save), "timings"}; anything
+    that goes wrong replies {"id", "ok": false, "error"}.  "image" and "map" in a
+    generate request say which of the two to send back (default: just the image).
+
+    Boards, saved ones handed to render included, are held to --max-cells, and images
+    to --max-pixels, so leave "scale" out (full size tiles) only for small boards.  If a
+    worker dies, its request fails and the pool is started afresh for the next ones.
+'''
+import os
+import io
+import sys
+import json
+import stat
+import time
+import base64
+import random
+import asyncio
+import argparse
+
+import algo
+
+MAX_CELLS = 250000 # biggest board a request may ask for
+MAX_PIXELS = 64 * 1024 * 1024 # biggest image a request may ask for, about 200MB of RGB
+LINE_LIMIT = 64 * 1024 * 1024 # longest request line, saved maps handed to "render" included
+
+# ================================================================================= #
+#                  __        __         _
+#                  \ \      / /__  _ __| | _____ _ __ ___
+#                   \ \ /\ / / _ \| '__| |/ / _ \ '__/ __|
+#                    \ V  V / (_) | |  |   <  __/ |  \__ \
+#                     \_/\_/ \___/|_|  |_|\_\___|_|  |___/
+#
+# ================================================================================= #
+_worker_tilesets = {} # name -> TileSet, loaded once per worker process
+
+def check_size(tile_set, width, height, scale, max_cells, max_pixels, image=True):
+    '''
+    raises ValueError for a board, or its image at scale, bigger than a request may ask for
+    '''
+    if width < 1 or height < 1 or width*height > max_cells:
+        raise ValueError(f"{width}x{height} isn't a board size this server makes (at most {max_cells} cells)")
+    if image:
+        tile_width, tile_height = tile_set.scaled_tile_wh(scale)
+        if width*tile_width * height*tile_height > max_pixels:
+            raise ValueError(f"a {width}x{height} board at {tile_width}x{tile_height} px tiles is bigger than this server draws "
+                             f"(at most {max_pixels} pixels), ask for a smaller scale")
+
+def _init_worker(tileset_files, rotations):
+    for name, filename in tileset_files.items():
+        tile_set = algo.TileSet(filename, rotations=rotations)
+        tile_set.tile_atlas() # decode every tile now, rather than during somebody's request
+        _worker_tilesets[name] = tile_set
+
+def _warm_up():
+    return os.getpid()
+
+def _encode_png(img):
+    from PIL import Image
+    buf = io.BytesIO()
+    # speed over size; these go straight to a browser on the local network
+    Image.fromarray(img).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+def _encode_map(maker):
+    buf = io.BytesIO()
+    maker.save(buf)
+    return buf.getvalue()
+
+def _generate(tileset, width, height, strategy, solver, seed, scale, want_image, want_map):
+    timings = {}
+    start = time.perf_counter()
+    maker = algo.MapMaker(_worker_tilesets[tileset], (width, height), strategy=strategy, solver=solver, seed=seed)
+    timings["generate"] = time.perf_counter() - start
+    result = {"seed": seed, "width": width, "height": height, "image": None, "map": None, "timings": timings}
+    if want_image:
+        start = time.perf_counter()
+        result["image"] = _encode_png(maker.render(scale=scale))
+        timings["render"] = time.perf_counter() - start
+    if want_map:
+        result["map"] = _encode_map(maker)
+    return result
+
+def _render(tileset, map_bytes, scale, max_cells, max_pixels):
+    timings = {}
+    start = time.perf_counter()
+    maker = algo.MapMaker.load(io.BytesIO(map_bytes), _worker_tilesets[tileset])
+    # only known once the map is read, so checked here rather than with the request
+    check_size(maker.tile_set, maker.width, maker.height, scale, max_cells, max_pixels)
+    img = maker.render(scale=scale)
+    result = {"seed": maker.seed, "width": maker.width, "height": maker.height, "image": _encode_png(img), "map": None, "timings": timings}
+    timings["render"] = time.perf_counter() - start
+    return result
+
+# ================================================================================= #
+#                    ____
+#                   / ___|  ___ _ ____   _____ _ __
+#                   \___ \ / _ \ '__\ \ / / _ \ '__|
+#                    ___) |  __/ |   \ V /  __/ |
+#                   |____/ \___|_|    \_/ \___|_|
+#
+# ================================================================================= #
+class MapServer:
+    '''
+    tileset_files : dict, name -> tile set file (.json or compiled), as requests name them
+    workers : worker processes for the map making.  Default is one per core
+    max_cells : largest width*height a request may ask for
+    max_pixels : largest image, in pixels, a request may ask for
+    rotations : also use every tile turned, see algo.TileSet
+    '''
+    def __init__(self, tileset_files, workers=None, max_cells=MAX_CELLS, max_pixels=MAX_PIXELS, rotations=False):
+        self.tileset_files = dict(tileset_files)
+        self.rotations = rotations
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.max_cells = max_cells
+        self.max_pixels = max_pixels
+        self._pool = None
+        # only the masks are needed here, to check requests against
+        self._tilesets = {name: algo.TileSet(filename, rotations=rotations) for name, filename in self.tileset_files.items()}
+
+    async def start(self):
+        from concurrent.futures import ProcessPoolExecutor
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.tileset_files, self.rotations))
+        # get every worker up and its tile sets loaded before taking requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, _warm_up) for _ in range(0, self.workers)])
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    async def serve_unix(self, path):
+        if os.path.lexists(path):
+            # a stale socket from a previous run; never anything else, a typo mustn't cost a file
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(f"{path} exists and isn't a socket")
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle_connection, path=path, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_tcp(self, port, host="127.0.0.1"):
+        server = await asyncio.start_server(self.handle_connection, host=host, port=port, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def answer(line):
+            reply = await self.handle_line(line)
+            async with lock:
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(answer(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass # the client went away, or sent something we can't read a line of
+        finally:
+            writer.close()
+
+    async def handle_line(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request is a JSON object")
+            request_id = request.get("id")
+            reply = await self.handle(request)
+            reply.update({"id": request_id, "ok": True})
+            return reply
+        except Exception as err:
+            return {"id": request_id, "ok": False, "error": f"{type(err).__name__}: {err}"}
+
+    async def run_in_pool(self, fn, *args):
+        from concurrent.futures.process import BrokenProcessPool
+        pool = self._pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (killed, out of memory), and a pool is no use after that;
+            # the first request to find out starts a new one, the rest just fail
+            if self._pool is pool:
+                pool.shutdown(wait=False)
+                await self.start()
+            raise RuntimeError("a map worker died during this request, the workers have been restarted") from None
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {}
+        if op == "tilesets":
+            return {"tilesets": {name: {"tiles": len(t.tiles), "tile_width": t.tile_width, "tile_height": t.tile_height}
+                                 for name, t in self._tilesets.items()}}
+        if op == "generate":
+            tileset = self._tileset_name(request)
+            width, height = int(request["width"]), int(request["height"])
+            scale, want_image = self._scale(request), bool(request.get("image", True))
+            check_size(self._tilesets[tileset], width, height, scale, self.max_cells, self.max_pixels, want_image)
+            strategy = request.get("strategy", "parceled")
+            if strategy not in algo.VERTEX_STRATEGIES:
+                raise ValueError(f"unknown strategy {strategy!r}, try one of {sorted(algo.VERTEX_STRATEGIES)}")
+            solver = request.get("solver", "greedy")
+            if solver not in algo.MapMaker.SOLVERS:
+                raise ValueError(f"unknown solver {solver!r}, try one of {sorted(algo.MapMaker.SOLVERS)}")
+            seed = request.get("seed")
+            seed = int(seed) if seed is not None else random.randrange(2**31)
+            result = await self.run_in_pool(_generate, tileset, width, height, strategy, solver, seed,
+                                            scale, want_image, bool(request.get("map", False)))
+        elif op == "render":
+            tileset = self._tileset_name(request)
+            result = await self.run_in_pool(_render, tileset, base64.b64decode(request["map"]), self._scale(request),
+                                            self.max_cells, self.max_pixels)
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        for key in ("image", "map"):
+            if result[key] is not None:
+                result[key] = base64.b64encode(result[key]).decode("ascii")
+        return result
+
+    def _tileset_name(self, request):
+        name = request.get("tileset")
+        if name is None and len(self._tilesets) == 1:
+            return next(iter(self._tilesets))
+        if name not in self._tilesets:
+            raise ValueError(f"unknown tileset {name!r}, try one of {sorted(self._tilesets)}")
+        return name
+
+    def _scale(self, request):
+        scale = request.get("scale")
+        if scale is None:
+            return None
+        scale = float(scale)
+        if not 0 < scale <= 1:
+            raise ValueError(f"scale {scale} should be in (0, 1]")
+        return scale
+
+def request(address, message):
+    '''
+    Send one request to a running server and wait for its reply.  address is the Unix
+    socket path, or a (host, port) pair.  Handy for scripts and checking on the server.
+    '''
+    import socket
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile('rb') as fid:
+            return json.loads(fid.readline())
+
+def parse_tileset_args(values):
+    # NAME=FILE, or just FILE, named after the file
+    result = {}
+    for value in values:
+        name, sep, filename = value.partition("=")
+        if not sep:
+            filename = value
+            name = os.path.splitext(os.path.basename(value))[0]
+        result[name] = filename
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve maps from warm tile sets, over a Unix socket or localhost TCP")
+    parser.add_argument("TILESET", type=str, nargs="+", help="Tile sets to serve, as FILE or NAME=FILE.  Requests pick one by NAME, which defaults to the file name without its extension")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket path to listen on")
+    parser.add_argument("--port", type=int, default=None, help="localhost TCP port to listen on, instead of a Unix socket")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes.  Default is one per core")
+    parser.add_argument("--rotate", action="store_true", help="Also use every tile turned CW, CCW and 180, for the unique tile sets")
+    parser.add_argument("--max-cells", type=int, default=MAX_CELLS, help=f"Largest board (width*height) a request may ask for.  Default is {MAX_CELLS}")
+    parser.add_argument("--max-pixels", type=int, default=MAX_PIXELS, help=f"Largest image (width*height in pixels) a request may ask for.  Default is {MAX_PIXELS}")
+
+    args = parser.parse_args()
+    if (args.socket is None) == (args.port is None):
+        parser.error("give one of --socket or --port")
+
+    async def main():
+        server = MapServer(parse_tileset_args(args.TILESET), workers=args.workers, max_cells=args.max_cells, max_pixels=args.max_pixels, rotations=args.rotate)
+        start = time.perf_counter()
+        await server.start()
+        where = args.socket if args.socket is not None else f"127.0.0.1:{args.port}"
+        print(f"serving {', '.join(server.tileset_files)} on {where} with {server.workers} workers (ready in {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+        for name, tile_set in server._tilesets.items():
+            # cheap next to loading, and much cheaper than finding out from failed requests
+            gaps = sum(1 for r in tile_set.coverage() if r["matches"] == 0 and r["scan"])
+            if gaps:
+                print(f"warning: {name} has no tile for {gaps} constraints the greedy solver can hit, see tools/coverage.py", file=sys.stderr)
+        try:
+            if args.socket is not None:
+                await server.serve_unix(args.socket)
+            else:
+                await server.serve_tcp(args.port)
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+else:
+    # pass explicitly
+    pass
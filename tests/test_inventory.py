@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+import algo
+
+ASSETS = os.path.join(HERE, "..", "assets")
+
+def counted_tileset(directory, count):
+    # the asset tile set with every piece but the all ocean and all land ones limited to count;
+    # matching never opens the images
+    with open(os.path.join(ASSETS, "trimmed-unique.json"), 'r') as fid:
+        obj = json.load(fid)
+    for record in obj["tile_list"]:
+        if record["edgemask"] not in ("0000", "1111"):
+            record["count"] = count
+    filename = os.path.join(directory, "counted.json")
+    with open(filename, 'w') as fid:
+        json.dump(obj, fid)
+    return algo.TileSet(filename, rotations=True)
+
+def made_maps(tile_set, **kwargs):
+    counts = np.array([-1 if count is None else count for count in tile_set.inventory()[1]])
+    made, used_up = 0, 0
+    for seed in range(0, 6):
+        try:
+            maker = algo.MapMaker(tile_set, seed=seed, **kwargs)
+        except RuntimeError:
+            continue
+        used = tile_set.inventory_used(maker.tile_grid)
+        assert not np.any((counts >= 0) & (used > counts))
+        made += 1
+        used_up += np.count_nonzero((counts >= 0) & (used == counts))
+    # maps got made, and the counts mattered to some of them
+    return made > 0 and used_up > 0
+
+def test_propagate_keeps_to_the_inventory(tmp_path):
+    assert made_maps(counted_tileset(tmp_path, 8), map_wh=(13, 9), solver="propagate")
+
+def test_strips_share_the_inventory(tmp_path):
+    assert made_maps(counted_tileset(tmp_path, 14), map_wh=(13, 21), solver="propagate", strips=3, workers=2)
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import subprocess
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+import algo
+
+ROTATE_TILES = os.path.join(HERE, "..", "tools", "rotate_tiles.py")
+
+def write_tileset(directory):
+    os.makedirs(os.path.join(directory, "tiles"))
+    tile_list = []
+    for n, (edge, colour) in enumerate((("1010", (200, 0, 0)), ("1100", (0, 200, 0)), ("0000", (0, 0, 200)))):
+        name = f"tiles/Tile_{n:02d}.png"
+        Image.new("RGB", (8, 8), colour).save(os.path.join(directory, name))
+        tile_list.append({"file": name, "bordermask": "11001100", "edgemask": edge, "sflg": "0000"})
+    filename = os.path.join(directory, "t.json")
+    with open(filename, 'w') as fid:
+        json.dump({"tile_directory": "", "tile_width": 8, "tile_height": 8, "tile_list": tile_list}, fid)
+    return filename
+
+def test_rotate_tiles_from_outside_the_json_directory(tmp_path):
+    write_tileset(os.path.join(tmp_path, "sub"))
+    subprocess.run([sys.executable, ROTATE_TILES, os.path.join("sub", "t.json"), "--outdir", os.path.join("sub", "rot"), "--jobs", "1"],
+                   cwd=tmp_path, check=True, capture_output=True)
+
+    modded = os.path.join(tmp_path, "sub", "tmodded.json")
+    with open(modded, 'r') as fid:
+        files = [record["file"] for record in json.load(fid)["tile_list"]]
+    # the all ocean tile isn't turned
+    assert len(files) == 3 + 2*3
+    assert os.path.join("rot", "Tile_00_CW.png") in files
+
+    tile_set = algo.TileSet(modded)
+    atlas = tile_set.tile_atlas()
+    assert atlas.shape[0] == len(files) + 1
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+'''
+    Times each phase of map generation, separately, across a range of board sizes:
+
+        vertex   - the vertex strategy laying out land and ocean
+        edges    - turning the verticies into per-cell edge masks
+        matching - placing tiles (MapMaker with the verticies handed in)
+        render   - MapMaker.render
+
+    Runs on a synthetic tile set of solid colour tiles written to a temp directory, so
+    it needs none of the assets.  Every edge mask gets one tile that ignores all border
+    constraints, so the greedy solver can never dead end and sizes stay comparable.
+
+    Results go to a .json file.  Hand an older one to --compare to see how things moved.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import algo
+
+DEFAULT_SIZES = ["13x9", "50x50", "100x100", "200x200", "500x500"]
+
+def make_synthetic_tileset(outdir, tile_px, variants, seed=0):
+    '''
+    Writes solid colour tiles and a tile set .json describing them into outdir.
+    returns the path of the .json
+    '''
+    rng = random.Random(seed)
+    tile_list = []
+    for edge in range(0, 16):
+        for variant in range(0, variants):
+            name = os.path.join(outdir, f"tile_{edge:02d}_{variant}.png")
+            colour = [rng.randrange(256) for _ in range(0, 3)]
+            Image.new("RGB", (tile_px, tile_px), tuple(colour)).save(name)
+            # the first variant ignores every border, so there's always a fit
+            sflg = 0b1111 if variant == 0 else rng.randrange(16)
+            tile_list.append({
+                "file": name,
+                "bordermask": algo.mask_string(rng.randrange(256), 8),
+                "edgemask": algo.mask_string(edge, 4),
+                "sflg": algo.mask_string(sflg, 4),
+            })
+
+    filename = os.path.join(outdir, "synthetic.json")
+    with open(filename, 'w') as fid:
+        json.dump({"tile_directory": "", "tile_width": tile_px, "tile_height": tile_px, "tile_list": tile_list}, fid, indent=4)
+    return filename
+
+def time_call(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def bench_size(tile_set, map_wh, strategy, solver, repeats, render):
+    width, height = map_wh
+    phases = {"vertex": [], "edges": [], "matching": [], "render": []}
+    for rep in range(0, repeats):
+        random.seed(rep)
+        rng = np.random.default_rng(rep)
+        elapsed, verts = time_call(lambda: algo.VERTEX_STRATEGIES[strategy](width, height, rng))
+        phases["vertex"].append(elapsed)
+        elapsed, _ = time_call(lambda: algo.cell_edge_masks(verts))
+        phases["edges"].append(elapsed)
+        elapsed, maker = time_call(lambda: algo.MapMaker(tile_set, map_wh, strategy=strategy, solver=solver, vertices=verts))
+        phases["matching"].append(elapsed)
+        if render:
+            elapsed, _ = time_call(maker.render)
+            phases["render"].append(elapsed)
+    summary = {}
+    for phase, samples in phases.items():
+        if samples:
+            summary[phase] = {"min": min(samples), "median": float(np.median(samples)), "samples": samples}
+    return summary
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results, baseline=None):
+    def key(r):
+        return (r["size"], r["strategy"], r["solver"])
+    before = {key(r): r for r in baseline["results"]} if baseline is not None else {}
+    for r in results:
+        line = f"{r['size']:>9} {r['strategy']:>16} {r['solver']:>9}"
+        for phase, stats in r["phases"].items():
+            line += f"  {phase} {stats['min']*1e3:9.2f}ms"
+            old = before.get(key(r), {}).get("phases", {}).get(phase)
+            if old is not None and stats["min"] > 0:
+                line += f" (x{old['min'] / stats['min']:5.2f})"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the map generation phases on a synthetic tile set")
+    parser.add_argument("--sizes", type=str, nargs="+", default=DEFAULT_SIZES, help="Board sizes as WxH.  Default is " + " ".join(DEFAULT_SIZES))
+    parser.add_argument("--strategy", type=str, nargs="+", default=["parceled"], choices=sorted(algo.VERTEX_STRATEGIES), help="Vertex strategies to run.  Default is 'parceled'")
+    parser.add_argument("--solver", type=str, nargs="+", default=["greedy"], choices=sorted(algo.MapMaker.SOLVERS), help="Solvers to run.  Default is 'greedy'")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per size; the min and median are kept.  Default is 3")
+    parser.add_argument("--tile-px", type=int, default=16, help="Synthetic tile size in pixels.  Default is 16, so big boards still fit in memory")
+    parser.add_argument("--variants", type=int, default=4, help="Tiles per edge mask in the synthetic set.  Default is 4")
+    parser.add_argument("--no-render", action="store_true", help="Skip the render phase")
+    parser.add_argument("--out", type=str, default="bench.json", help="Where to write results.  Default is 'bench.json'")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results .json to compare against (shown as speedup)")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tile_set = algo.TileSet(make_synthetic_tileset(tmpdir, args.tile_px, args.variants))
+        # one-off tile decoding isn't what we're measuring, so get it out of the way
+        atlas_time, _ = time_call(tile_set.tile_atlas)
+        results = []
+        for size in args.sizes:
+            width, height = (int(v) for v in size.lower().split("x"))
+            for strategy in args.strategy:
+                for solver in args.solver:
+                    phases = bench_size(tile_set, (width, height), strategy, solver, args.repeats, not args.no_render)
+                    results.append({"size": size, "width": width, "height": height, "strategy": strategy, "solver": solver,
+                                    "cells": width*height, "phases": phases})
+                    print_results(results[-1:])
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "tile_px": args.tile_px,
+            "tiles": 16*args.variants,
+            "repeats": args.repeats,
+            "atlas_build": atlas_time,
+        },
+        "results": results,
+    }
+    with open(args.out, 'w') as fid:
+        json.dump(report, fid, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fid:
+            baseline = json.load(fid)
+        print(f"\ncompared against {args.compare} ({baseline['meta'].get('revision')}):")
+        print_results(results, baseline)
+
+else:
+    # pass explicitly
+    pass
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+'''
+    Measures what a fresh generator process pays before it can do any work:
+
+        interpreter - bare `python -c pass`
+        import      - `import algo`, on top of the interpreter
+        first map   - import, load a tile set and make one map (with --tileset)
+
+    Each is run in a brand new process, --repeats times, keeping the min and median.
+    Also lists which of the heavy optional modules `import algo` dragged in; for the
+    headless generation path that list should be empty.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HEAVY_MODULES = ["matplotlib", "skimage", "PIL", "scipy", "concurrent.futures"]
+
+def time_process(code, repeats):
+    samples = []
+    env = dict(os.environ, PYTHONPATH=SRC_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    for _ in range(0, repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=env)
+        samples.append(time.perf_counter() - start)
+    return {"min": min(samples), "median": statistics.median(samples), "samples": samples}
+
+def heavy_modules_loaded():
+    code = f"import sys, algo; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=SRC_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True, text=True)
+    return out.stdout.split()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generator process start up")
+    parser.add_argument("--repeats", type=int, default=10, help="Fresh processes per measurement.  Default is 10")
+    parser.add_argument("--tileset", type=str, default=None, help="Tile set (.json or compiled) to also time loading plus one map with")
+    parser.add_argument("--size", type=str, default="13x9", help="Map size for the first map timing, as WxH.  Default is 13x9")
+    parser.add_argument("--out", type=str, default=None, help="Write the results to this .json too")
+
+    args = parser.parse_args()
+
+    results = {}
+    results["interpreter"] = time_process("pass", args.repeats)
+    results["import"] = time_process("import algo", args.repeats)
+    if args.tileset is not None:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        code = f"import algo; algo.MapMaker(algo.TileSet({os.path.abspath(args.tileset)!r}), ({width}, {height}), solver='propagate')"
+        results["first_map"] = time_process(code, args.repeats)
+    heavy = heavy_modules_loaded()
+
+    base = results["interpreter"]["min"]
+    for name, stats in results.items():
+        extra = "" if name == "interpreter" else f"  (+{(stats['min'] - base)*1e3:7.1f}ms over the interpreter)"
+        print(f"{name:>12}: min {stats['min']*1e3:7.1f}ms  median {stats['median']*1e3:7.1f}ms{extra}")
+    print(f"heavy modules pulled in by `import algo`: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.out is not None:
+        with open(args.out, 'w') as fid:
+            json.dump({"results": results, "heavy_modules": heavy}, fid, indent=4)
+
+    sys.exit(1 if heavy else 0)
+
+else:
+    # pass explicitly
+    pass
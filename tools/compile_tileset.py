@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+'''
+    Packs a tile set .json, with every tile image decoded and resized, into one compiled
+    file that TileSet memory maps on load.  algo.py takes the result anywhere it takes
+    the .json.
+
+    Tile image paths in the .json are relative to the .json's directory and its
+    tile_directory, as TileSet reads them, so this runs from anywhere.
+'''
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import algo
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a tile set .json into a memory mappable tile set")
+    parser.add_argument("JSON", type=str, help="Tile set .json")
+    parser.add_argument("OUT", type=str, nargs="?", default=None, help="Output file.  Default is the .json name with a .tiles extension")
+    parser.add_argument("--rotate", action="store_true", help="Compile in every tile turned CW, CCW and 180 too, for the unique tile sets")
+
+    args = parser.parse_args()
+
+    out = args.OUT if args.OUT is not None else os.path.splitext(args.JSON)[0] + ".tiles"
+    start = time.perf_counter()
+    tile_set = algo.TileSet(args.JSON, rotations=args.rotate)
+    tile_set.compile(out)
+    print(f"compiled {len(tile_set.tiles)} tiles into {out} ({os.path.getsize(out) / 2**20:.1f} MiB) in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    algo.TileSet(out)
+    print(f"loads in {(time.perf_counter() - start)*1e3:.1f}ms")
+
+else:
+    # pass explicitly
+    pass
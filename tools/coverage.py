@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+'''
+    Finds the gaps in a tile set before a map run does: every constraint a cell can put to
+    find_tile, from every layout of its verticies and every neighbour that could be next
+    to it, matched against the whole tile set at once (see TileSet.coverage).
+
+    Gaps the greedy scan can hit on a plain map are listed first, they're what kills
+    production runs.  The rest only come up against fixed tiles on the right or below,
+    in strips and reroll().  Each gap is printed as the tile that would fill it, in the
+    tile_list .json mask format, "--" marking border pairs on sides anything goes.
+
+    Exits 1 if the greedy scan has gaps.
+'''
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import algo
+
+def border_string(bordermask, sflg):
+    pairs = algo.mask_string(bordermask, 8)
+    return "".join("--" if ( sflg >> side ) & 1 else pairs[2*side:2*side+2] for side in range(0, 4))
+
+def describe(tile):
+    turned = "" if tile.rotation == algo.TileRotation.NONE else f" {tile.rotation.name}"
+    return f"{tile.imgfile}{turned}"
+
+def gap_lines(tile_set, record):
+    example = record["example"]
+    (tl, tr), (bl, br) = example["vertices"]
+    neighbours = ", ".join(f"{side} {describe(tile_set.tiles[n])}" for side, n in example["neighbours"].items())
+    first = record["pinned"][0]
+    pinned = " ".join(first) if first else "none"
+    if len(record["pinned"]) > 1:
+        pinned += f" (or {len(record['pinned']) - 1} other sets of sides)"
+    return [
+        f"  edgemask {algo.mask_string(record['edgemask'], 4)}  bordermask {border_string(record['bordermask'], record['sflg'])}",
+        f"      neighbours on: {pinned}",
+        f"      e.g. verticies {tl}{tr}/{bl}{br}, next to {neighbours if neighbours else 'nothing'}",
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the constraints a tile set has no tile for")
+    parser.add_argument("TILESET", type=str, help="Tile set .json, or one compiled by tools/compile_tileset.py")
+    parser.add_argument("--rotate", action="store_true", help="Also use every tile turned CW, CCW and 180, as algo.py --rotate does")
+    parser.add_argument("--scan-only", action="store_true", help="Only report gaps the greedy scan of a plain map can hit")
+    parser.add_argument("--out", type=str, default=None, help="Write every constraint and its match count to this .json too")
+
+    args = parser.parse_args()
+
+    tile_set = algo.TileSet(args.TILESET, rotations=args.rotate)
+    records = tile_set.coverage()
+    gaps = [r for r in records if r["matches"] == 0]
+    scan_gaps = [r for r in gaps if r["scan"]]
+    other_gaps = [r for r in gaps if not r["scan"]]
+
+    print(f"{len(tile_set.tiles)} tiles, {len(records)} distinct constraints, {len(gaps)} with no tile "
+          f"({len(scan_gaps)} on the greedy scan)")
+    if scan_gaps:
+        print("\ngaps the greedy scan can hit:")
+        for record in sorted(scan_gaps, key=lambda r: (r["edgemask"], r["bordermask"], r["sflg"])):
+            print("\n".join(gap_lines(tile_set, record)))
+    if other_gaps and not args.scan_only:
+        print("\ngaps against fixed tiles to the right or below (strips, reroll):")
+        for record in sorted(other_gaps, key=lambda r: (r["edgemask"], r["bordermask"], r["sflg"])):
+            print("\n".join(gap_lines(tile_set, record)))
+
+    if args.out is not None:
+        with open(args.out, 'w') as fid:
+            json.dump({"tileset": args.TILESET, "tiles": len(tile_set.tiles), "constraints": records}, fid, indent=4)
+
+    sys.exit(1 if scan_gaps else 0)
+
+else:
+    # pass explicitly
+    pass
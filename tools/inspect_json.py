@@ -1,52 +1,254 @@
 #!/usr/bin/env python
 
+'''
+    Shows the tiles of a tile record .json one at a time, with their masks, to check
+    them by eye.
+
+    With --sheet, draws every tile into contact sheet PNGs instead, headless, so a
+    whole tile set is one look.  On each tile:
+
+        edge mask   : a bar along each side, green for land, blue for ocean
+        border mask : two squares per side for its border pair, drawn clockwise round the
+                      tile, first character first.  White for 1, black for 0
+        sflg        : the squares on a side whose borders are ignored are light and dark
+                      grey instead
+
+    and under it, the tile's number, file (and turn, with --rotate) and its masks as the
+    .json writes them.
+
+    Records are checked first: masks of the right length, all 0 and 1, and a file that's
+    there.  Bad ones are listed and left out.  Exits 1 if there were any.
+
+    Files are found the way algo.TileSet finds them, relative to the .json and its
+    tile_directory, so this runs from anywhere.
+'''
+import os
+import sys
+import json
 import argparse
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
-import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import algo
+
+MASK_LENGTHS = {"bordermask": 8, "edgemask": 4, "sflg": 4}
+LABEL_PX = 26 # room for two lines of the default font under each tile
+PAD_PX = 6
+BACKGROUND = 40
+LAND = (60, 170, 60)
+OCEAN = (40, 90, 200)
+BIT_COLORS = np.array([[[0, 0, 0], [255, 255, 255]],      # [ignored][bit]
+                       [[90, 90, 90], [190, 190, 190]]], dtype=np.uint8)
+
+def validate(obj, root):
+    '''
+    root is the directory the records' files are relative to (algo.TileSet.tile_directory_of)
+    returns the tile_list records that are fine, and (record number, file, problem) for the rest
+    '''
+    good, problems = [], []
+    for idx, record in enumerate(obj.get("tile_list", [])):
+        name = record.get("file")
+        found = []
+        if name is None:
+            found.append("no file")
+        elif not os.path.isfile(os.path.join(root, name)):
+            found.append("file doesn't exist")
+        for key, length in MASK_LENGTHS.items():
+            value = record.get(key)
+            if not isinstance(value, str) or len(value) != length or set(value) - set("01"):
+                found.append(f"{key} {value!r} isn't {length} characters of 0 and 1")
+        if not found:
+            try:
+                algo.TileSet.parse_record(record)
+            except (ValueError, TypeError) as err:
+                found.append(str(err))
+        problems.extend((idx, name, problem) for problem in found)
+        if not found:
+            good.append(record)
+    if "tile_list" not in obj:
+        problems.append((None, None, "no tile_list"))
+    return good, problems
+
+def to_tiles(records, rotations=False):
+    # the same tiles algo.TileSet makes of the records
+    tiles = [algo.TileSet.parse_record(r) for r in records]
+    if rotations:
+        tiles = tiles + algo.TileSet.add_rotations(tiles)
+    return tiles
+
+def thumbnails(tiles, cell, root):
+    '''
+    every tile's image, its file under root, at cell x cell, as one (n, cell, cell, 3) array; each file is
+    decoded once, shrunk while decoding where the format allows, and turned as a view
+    returns the array, and (file, problem) for files that wouldn't decode (left blank)
+    '''
+    thumbs = np.full((len(tiles), cell, cell, 3), BACKGROUND, dtype=np.uint8)
+    decoded, problems = {}, []
+    for n, tile in enumerate(tiles):
+        if tile.imgfile not in decoded:
+            try:
+                img = Image.open(os.path.join(root, tile.imgfile))
+                img.draft("RGB", (cell, cell))
+                img = img.convert("RGB")
+                factor = min(img.size) // cell
+                if factor > 1:
+                    img = img.reduce(factor)
+                decoded[tile.imgfile] = np.asarray(img.resize((cell, cell)))
+            except Exception as err:
+                decoded[tile.imgfile] = None
+                problems.append((tile.imgfile, f"{type(err).__name__}: {err}"))
+        if decoded[tile.imgfile] is not None:
+            thumbs[n] = algo.rotate_pixels(decoded[tile.imgfile], tile.rotation)
+    return thumbs, problems
+
+def draw_masks(thumbs, tiles):
+    '''
+    draws the mask glyphs onto thumbs, in place, each glyph for every tile in one go
+    '''
+    cell = thumbs.shape[1]
+    bar = max(2, cell // 32)
+    dot = max(3, cell // 12)
+    edges = np.array([t.edge_id_mask for t in tiles], dtype=np.uint8)
+    borders = np.array([t.border_point_mask for t in tiles], dtype=np.uint8)
+    sflgs = np.array([t.special_flags for t in tiles], dtype=np.uint8)
+    palette = np.array([OCEAN, LAND], dtype=np.uint8)
+
+    # a bar along each side, in TileSide order
+    bars = (np.s_[:, :bar, :], np.s_[:, :, cell-bar:], np.s_[:, cell-bar:, :], np.s_[:, :, :bar])
+    for side, region in enumerate(bars):
+        thumbs[region] = palette[( edges >> side ) & 1][:, None, None, :]
+
+    # the border pair's squares, clockwise round the tile: (row, col) of each square's corner
+    near, far = bar + 1, cell - bar - 1 - dot
+    third, two_thirds = cell // 3 - dot // 2, 2 * cell // 3 - dot // 2
+    squares = (((near, third), (near, two_thirds)),
+               ((third, far), (two_thirds, far)),
+               ((far, two_thirds), (far, third)),
+               ((two_thirds, near), (third, near)))
+    for side, pair in enumerate(squares):
+        ignored = ( sflgs >> side ) & 1
+        for bit, (row, col) in enumerate(pair):
+            value = ( borders >> (2*side + bit) ) & 1
+            thumbs[:, row:row+dot, col:col+dot] = BIT_COLORS[ignored, value][:, None, None, :]
+    return thumbs
+
+def label(tile, n):
+    turned = "" if tile.rotation == algo.TileRotation.NONE else f" {tile.rotation.name}"
+    return (f"{n} {os.path.basename(tile.imgfile)}{turned}",
+            f"{algo.mask_string(tile.border_point_mask, 8)} {algo.mask_string(tile.edge_id_mask, 4)} {algo.mask_string(tile.special_flags, 4)}")
+
+def contact_sheet(thumbs, labels, columns):
+    '''
+    lays thumbs out in a grid, columns wide, with each tile's two label lines under it
+    returns the sheet as a PIL image
+    '''
+    from PIL import ImageDraw, ImageFont
+    n, cell = thumbs.shape[:2]
+    rows = -(-n // columns)
+    cell_h, cell_w = PAD_PX + cell + LABEL_PX, PAD_PX + cell
+    cells = np.full((rows*columns, cell_h, cell_w, 3), BACKGROUND, dtype=np.uint8)
+    cells[:n, PAD_PX:PAD_PX+cell, PAD_PX:] = thumbs
+    # (rows*columns, h, w, c) -> (rows*h, columns*w, c)
+    sheet = cells.reshape(rows, columns, cell_h, cell_w, 3).transpose(0, 2, 1, 3, 4).reshape(rows*cell_h, columns*cell_w, 3)
+    sheet = np.pad(sheet, ((0, PAD_PX), (0, PAD_PX), (0, 0)), constant_values=BACKGROUND)
+
+    img = Image.fromarray(sheet)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+    for k, lines in enumerate(labels):
+        x = (k % columns) * cell_w + PAD_PX
+        y = (k // columns) * cell_h + PAD_PX + cell + 2
+        for line in lines:
+            draw.text((x, y), line, fill=(230, 230, 230), font=font)
+            y += LABEL_PX // 2
+    return img
+
+def write_sheets(tiles, root, filename, cell, columns, per_sheet):
+    '''
+    contact sheets of tiles, per_sheet tiles each.  One sheet is written to filename;
+    more are numbered, name_1.png, name_2.png, ...
+    returns the files written, and (file, problem) for images that wouldn't decode
+    '''
+    thumbs, problems = thumbnails(tiles, cell, root)
+    draw_masks(thumbs, tiles)
+    labels = [label(tile, n) for n, tile in enumerate(tiles)]
+    base, ext = os.path.splitext(filename)
+    count = max(1, -(-len(tiles) // per_sheet))
+    written = []
+    for k in range(0, count):
+        name = filename if count == 1 else f"{base}_{k+1}{ext}"
+        chunk = slice(k*per_sheet, (k+1)*per_sheet)
+        contact_sheet(thumbs[chunk], labels[chunk], min(columns, max(1, len(labels[chunk])))).save(name, compress_level=1)
+        written.append(name)
+    return written, problems
+
+def show_tiles(records, root):
+    import matplotlib.pyplot as plt
+
+    for tile in records:
+        brd = tile["bordermask"]
+        img = Image.open(os.path.join(root, tile["file"]))
+        edge = tile["edgemask"]
+
+        plt.subplot(2,2,1)
+        plt.imshow(img)
+        plt.title(tile["file"])
+
+        plt.subplot(2,2,2)
+        plt.text(0.5, 0.8, "TOP")
+        plt.text(0.5, 0.7, brd[0:2])
+        plt.text(0.8, 0.5, "RHT")
+        plt.text(0.7, 0.5, brd[2:4])
+        plt.text(0.5, 0.2, "BOT")
+        plt.text(0.5, 0.3, brd[4:6])
+        plt.text(0.2, 0.5, "LFT")
+        plt.text(0.33, 0.5, brd[6:8])
+
+        plt.subplot(2,2,3)
+        plt.text(0.5, 0.8, "TOP")
+        plt.text(0.5, 0.7, edge[0])
+        plt.text(0.8, 0.5, "RHT")
+        plt.text(0.7, 0.5, edge[1])
+        plt.text(0.5, 0.2, "BOT")
+        plt.text(0.5, 0.3, edge[2])
+        plt.text(0.2, 0.5, "LFT")
+        plt.text(0.33, 0.5, edge[3])
+        plt.title('edge')
+
+        plt.show()
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="merp")
+    parser = argparse.ArgumentParser(description="Check the tiles of a tile record json by eye")
     parser.add_argument("JSON", type=str, help="A tile record json")
+    parser.add_argument("--sheet", type=str, default=None, help="Write contact sheet PNGs here instead of showing tiles one at a time")
+    parser.add_argument("--rotate", action="store_true", help="Sheets: also draw every tile turned CW, CCW and 180, as algo.py --rotate uses them")
+    parser.add_argument("--cell", type=int, default=128, help="Sheets: tile size, in pixels.  Default is 128")
+    parser.add_argument("--columns", type=int, default=12, help="Sheets: tiles across.  Default is 12")
+    parser.add_argument("--per-sheet", type=int, default=144, help="Sheets: tiles per sheet.  Default is 144")
 
     args = parser.parse_args()
 
     with open(args.JSON, 'r') as fid:
         obj = json.load(fid)
 
-        for tile in obj["tile_list"]:
-            brd = tile["bordermask"]
-            img = Image.open(tile["file"])
-            edge = tile["edgemask"]
-            sflg = tile["sflg"]
-
-            plt.subplot(2,2,1)
-            plt.imshow(img)
-            plt.title(tile["file"])
-
-            plt.subplot(2,2,2)
-            plt.text(0.5, 0.8, "TOP")
-            plt.text(0.5, 0.7, brd[0:2])
-            plt.text(0.8, 0.5, "RHT")
-            plt.text(0.7, 0.5, brd[2:4])
-            plt.text(0.5, 0.2, "BOT")
-            plt.text(0.5, 0.3, brd[4:6])
-            plt.text(0.2, 0.5, "LFT")
-            plt.text(0.33, 0.5, brd[6:8])
-
-            plt.subplot(2,2,3)
-            plt.text(0.5, 0.8, "TOP")
-            plt.text(0.5, 0.7, edge[0])
-            plt.text(0.8, 0.5, "RHT")
-            plt.text(0.7, 0.5, edge[1])
-            plt.text(0.5, 0.2, "BOT")
-            plt.text(0.5, 0.3, edge[2])
-            plt.text(0.2, 0.5, "LFT")
-            plt.text(0.33, 0.5, edge[3])
-            plt.title('edge')
-
-            plt.show()
+    root = algo.TileSet.tile_directory_of(args.JSON, obj)
+    records, problems = validate(obj, root)
+    for idx, name, problem in problems:
+        print(f"record {idx} ({name}): {problem}" if idx is not None else problem, file=sys.stderr)
 
+    if args.sheet is None:
+        show_tiles(records, root)
+    else:
+        tiles = to_tiles(records, args.rotate)
+        written, unreadable = write_sheets(tiles, root, args.sheet, args.cell, args.columns, args.per_sheet)
+        for name, problem in unreadable:
+            print(f"{name}: {problem}", file=sys.stderr)
+        problems += unreadable
+        print(f"drew {len(tiles)} tiles into {', '.join(written)}")
 
+    sys.exit(1 if problems else 0)
 
+else:
+    # pass explicitly
+    pass
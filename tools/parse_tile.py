@@ -12,22 +12,24 @@
     resizes the square crops to the same size
 
     writes all 4 to disk as separate images
+
+    Hand it directories (or several scans) and it does the lot across worker processes,
+    also writing a draft tile_list .json with an entry per crop, masks left at zero to
+    fill in.  Segmentation runs on a downsampled copy of each scan; the boxes found are
+    scaled back up and the crops taken from the full resolution image.
 '''
 import os
+import json
 import argparse
 from PIL import Image
 import numpy as np
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-
-from skimage.filters import threshold_otsu
-from skimage.segmentation import clear_border
 from skimage.measure import label, regionprops
-from skimage.morphology import closing, footprint_rectangle
-from skimage.color import rgb2gray, rgb2hsv
 
 FINAL_SIZE = 300
+MIN_TILE_SIDE = 200
+SCAN_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+DRAFT_NAME = "tile_list_draft.json"
 
 def read_image(filename):
     return Image.open(filename)
@@ -35,24 +37,43 @@ def read_image(filename):
 def my_convert(image: np.ndarray):
     return image[...,1]
 
-def crop_tiles(image: Image):
+def auto_downsample(image: Image, target=1000):
+    '''
+    integer factor that brings the long side of image down to about target pixels
+    '''
+    return max(1, max(image.size) // target)
+
+def crop_tiles(image: Image, downsample=1):
     '''
     modified from the example on scikit-image:
         https://scikit-image.org/docs/stable/auto_examples/segmentation/plot_label.html#sphx-glr-auto-examples-segmentation-plot-label-py
+
+    With downsample > 1 the labelling runs on an image that much smaller on each side.
+    Boxes are scaled back rounding outwards, so a crop is at most downsample pixels
+    looser per side than a full resolution pass; well under a pixel once resized to
+    FINAL_SIZE.
     '''
 
+    small = image.reduce(downsample) if downsample > 1 else image
+
     # apply threshold
-    grayimg = my_convert(np.asarray(image))
+    grayimg = my_convert(np.asarray(small))
     bw = grayimg < 240
 
     # label image regions
     label_image = label(bw)
 
     TRIM = 0
+    min_area = (MIN_TILE_SIDE // downsample)**2
+    width, height = image.size
+    # a block only partly over a tile can average out light, so allow one more
+    pad = 1 if downsample > 1 else 0
     result = []
     for region in regionprops(label_image):
-        if region.area > 200**2:
+        if region.area > min_area:
             minr, minc, maxr, maxc = region.bbox
+            minr, minc = max(0, (minr-pad)*downsample), max(0, (minc-pad)*downsample)
+            maxr, maxc = min(height, (maxr+pad)*downsample), min(width, (maxc+pad)*downsample)
             result.append([minc+TRIM, minr+TRIM, maxc-TRIM, maxr-TRIM])
 
     assert(len(result)>=4)
@@ -60,7 +81,8 @@ def crop_tiles(image: Image):
 
 
 def display_results(image: Image, crops):
-   
+    import matplotlib.pyplot as plt
+
     plt.figure(1)
     for idx, c in enumerate(crops):
         if idx > 3:
@@ -76,28 +98,128 @@ def display_results(image: Image, crops):
 
 def write_results(image: Image, crops, name: str):
     assert(len(crops)>=4)
+    written = []
     for idx, c in enumerate(crops):
-        image.crop(c).resize([FINAL_SIZE, FINAL_SIZE]).save(f"{name}_{idx}.png")
+        filename = f"{name}_{idx}.png"
+        image.crop(c).resize([FINAL_SIZE, FINAL_SIZE]).save(filename)
+        written.append(filename)
+    return written
+
+def draft_entry(filename):
+    '''
+    tile_list entry for a freshly cropped tile, masks still to be filled in by hand
+    '''
+    return {"file": filename, "bordermask": "00000000", "edgemask": "0000", "sflg": "0000"}
+
+def list_scans(paths):
+    scans = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(SCAN_EXTENSIONS):
+                    scans.append(os.path.join(path, name))
+        else:
+            scans.append(path)
+    return scans
+
+def output_base(filename, outdir=None):
+    # where a scan's crops go, less the _<n>.png
+    base = os.path.splitext(filename)[0]
+    if outdir is not None:
+        base = os.path.join(outdir, os.path.basename(base))
+    return base
+
+def process_scan(filename, outdir=None, downsample=None):
+    '''
+    crops one scan and writes its tiles, into outdir if given else next to the scan
+    returns (filename, written tile files, error message or None)
+    '''
+    try:
+        image = read_image(filename)
+        image.load()
+        factor = auto_downsample(image) if downsample is None else downsample
+        crops = crop_tiles(image, factor)
+        return filename, write_results(image, crops, output_base(filename, outdir)), None
+    except Exception as e:
+        return filename, [], f"{type(e).__name__}: {e}"
+
+def run_batch(scans, outdir=None, downsample=None, jobs=None, draft=None):
+    '''
+    crops every scan across jobs worker processes and writes the draft tile_list .json,
+    its file paths relative to the draft's own directory like every other tile set
+    returns the list of (scan, error message) that failed
+    raises ValueError, before cropping anything, if two scans would write the same crops
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+
+    bases = {}
+    for scan in scans:
+        base = os.path.normpath(output_base(scan, outdir))
+        if base in bases:
+            raise ValueError(f"{bases[base]} and {scan} would both write {base}_<n>.png, rename one or crop them separately")
+        bases[base] = scan
+
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    tile_list = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_scan, scan, outdir, downsample) for scan in scans]
+        # collected in submission order so the draft is stable from run to run
+        for future in futures:
+            scan, written, error = future.result()
+            if error is not None:
+                print(f"failed  {scan}: {error}")
+                failed.append((scan, error))
+                continue
+            print(f"cropped {scan}: {len(written)} tiles")
+            tile_list.extend(draft_entry(name) for name in written)
+
+    if draft is not None:
+        draft_dir = os.path.dirname(os.path.abspath(draft))
+        for entry in tile_list:
+            entry["file"] = os.path.relpath(entry["file"], draft_dir)
+        with open(draft, 'w') as fid:
+            json.dump({"tile_directory": "", "tile_width": FINAL_SIZE, "tile_height": FINAL_SIZE, "tile_list": tile_list}, fid, indent=4)
+        print(f"wrote {len(tile_list)} draft entries to {draft}")
+    return failed
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="STUB")
-    parser.add_argument("FILE", type=str, help="Image file of the tile")
+    parser = argparse.ArgumentParser(description="Crop the tiles out of scanned tile photos")
+    parser.add_argument("FILE", type=str, nargs="+", help="Image file of the tile.  Several files, directories of them, or any batch option run as a batch")
     parser.add_argument("--debug", action="store_true", help="Just output figures.  Don't write to file.")
+    parser.add_argument("--downsample", type=int, default=None, help="Segment on an image this many times smaller per side.  Default picks one giving about 1000px, 1 is full resolution")
+    parser.add_argument("--outdir", type=str, default=None, help="Batch: write tiles here instead of next to each scan")
+    parser.add_argument("--jobs", type=int, default=None, help="Batch: worker processes.  Default is one per CPU")
+    parser.add_argument("--draft", type=str, default=None, help=f"Batch: draft tile_list .json.  Default is {DRAFT_NAME} in --outdir, or the current directory")
 
     args = parser.parse_args()
 
-    input_img = read_image(args.FILE)
+    batch_options = [flag for flag, value in (("--outdir", args.outdir), ("--jobs", args.jobs), ("--draft", args.draft)) if value is not None]
+    if args.debug and batch_options:
+        parser.error(f"--debug only shows a single scan, it can't be used with {', '.join(batch_options)}")
+
+    # a single scan given any batch option is cropped as a batch of one
+    if len(args.FILE) == 1 and not os.path.isdir(args.FILE[0]) and not batch_options:
+        input_img = read_image(args.FILE[0])
 
-    tiles = crop_tiles(input_img)
+        factor = auto_downsample(input_img) if args.downsample is None else args.downsample
+        tiles = crop_tiles(input_img, factor)
 
-    if args.debug is True:
-        display_results(input_img, tiles)
+        if args.debug is True:
+            display_results(input_img, tiles)
+        else:
+            base, ext = os.path.splitext(args.FILE[0])
+            write_results(input_img, tiles, base)
     else:
-        base, ext = os.path.splitext(args.FILE)
-        write_results(input_img, tiles, base)
+        draft = args.draft if args.draft is not None else os.path.join(args.outdir or ".", DRAFT_NAME)
+        try:
+            failed = run_batch(list_scans(args.FILE), args.outdir, args.downsample, args.jobs, draft)
+        except ValueError as e:
+            parser.error(str(e))
+        if failed:
+            raise SystemExit(f"{len(failed)} scans failed")
 
 else:
     # pass explicitly
     pass
-
-
@@ -7,38 +7,73 @@ from enum import Enum
 import os
 import copy
 import sys
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import algo
+
+MANIFEST_NAME = "manifest.json"
 
 class Rot(Enum):
     CW = 1
     CCW = 2
     FULL180 = 3
 
-def to_angle(direction: Rot):
+ALL_ROTATIONS = (Rot.CW, Rot.CCW, Rot.FULL180)
+
+def to_transpose(direction: Rot):
+    # lossless quarter turns, rather than resampling through Image.rotate
     if direction == Rot.CW:
-        return -90
+        return Image.Transpose.ROTATE_270
     if direction == Rot.CCW:
-        return 90
+        return Image.Transpose.ROTATE_90
     if direction == Rot.FULL180:
-        return 180
-    return 0
+        return Image.Transpose.ROTATE_180
+    return None
 
 def read_json(filepath):
     with open(filepath, 'r') as fid:
         return json.load(fid)
 
-def rotate_image_file(elem, direct: Rot, outdir):
-    if os.path.isdir(outdir) is False:
-        os.mkdir(outdir)
-    
-    origfile = elem
+def rotated_filename(origfile, direct: Rot, outdir):
+    name, ext = os.path.splitext(os.path.basename(origfile))
+    return os.path.join(outdir, name) + '_' + direct.name + '.png'
 
-    img = Image.open(origfile).rotate(to_angle(direct))
+def hash_file(filepath):
+    with open(filepath, 'rb') as fid:
+        return hashlib.sha256(fid.read()).hexdigest()
 
-    name, ext = os.path.splitext(os.path.basename(origfile))
-    newfilename = os.path.join(outdir, name) + '_' + direct.name + '.png'
-    img.save(newfilename)
+def read_manifest(outdir):
+    '''
+    The manifest remembers, per source image, the hash it had when its rotations were
+    last written, so unchanged images can be skipped.  Masks don't go into the images;
+    the rotated records are always made afresh from the current ones
+    '''
+    filepath = os.path.join(outdir, MANIFEST_NAME)
+    if not os.path.isfile(filepath):
+        return {}
+    return read_json(filepath)
 
-    return newfilename
+def write_manifest(outdir, manifest):
+    with open(os.path.join(outdir, MANIFEST_NAME), 'w') as fid:
+        json.dump(manifest, fid, indent=4, sort_keys=True)
+
+def rotate_if_changed(origfile, outdir, known_hash):
+    '''
+    Writes all the rotations of one image, unless it hashes the same as last time and
+    they're all still there.  Runs in the worker pool.
+    returns (hash, whether anything was written)
+    '''
+    digest = hash_file(origfile)
+    outputs = [rotated_filename(origfile, direct, outdir) for direct in ALL_ROTATIONS]
+    if digest == known_hash and all(os.path.isfile(f) for f in outputs):
+        return digest, False
+    img = Image.open(origfile)
+    img.load()
+    for direct, newfilename in zip(ALL_ROTATIONS, outputs):
+        img.transpose(to_transpose(direct)).save(newfilename)
+    return digest, True
 
 def __rotate_string(string, n):
     ''' 
@@ -47,34 +82,32 @@ def __rotate_string(string, n):
     '''
     return string[n:] + string[:n]
 
+# the mask rotations themselves live in algo.py, which also turns tiles in memory (TileSet(rotations=True))
+TO_TILE_ROTATION = {Rot.CW: algo.TileRotation.CW, Rot.CCW: algo.TileRotation.CCW, Rot.FULL180: algo.TileRotation.TURN180}
+
 def rotate_edge_mask(elem, direct: Rot):
-    if direct == Rot.CW:
-        elem = __rotate_string(elem, -1)
-    if direct == Rot.CCW:
-        elem = __rotate_string(elem, 1)
-    if direct == Rot.FULL180:
-        elem = __rotate_string(elem, 2)
-    return elem
+    turns = algo.ROTATION_TURNS[TO_TILE_ROTATION[direct]]
+    return algo.mask_string(algo.rotate_edge_bits(algo.parse_mask(elem), turns), 4)
 
 def rotate_sflgs(elem, direct: Rot):
     return rotate_edge_mask(elem, direct)
 
 def rotate_border_mask(elem, direct: Rot):
-    if direct == Rot.CW:
-        elem = __rotate_string(elem, -2)
-    if direct == Rot.CCW:
-        elem = __rotate_string(elem, 2)
-    if direct == Rot.FULL180:
-        elem = __rotate_string(elem, 4)
-    return elem
-
-def rotate_tile(elem, direct: Rot, outdir):
+    turns = algo.ROTATION_TURNS[TO_TILE_ROTATION[direct]]
+    return algo.mask_string(algo.rotate_border_bits(algo.parse_mask(elem), turns), 8)
+
+def rotate_tile(elem, direct: Rot, outdir, root):
+    # the record for elem turned; its image is written by rotate_if_changed
+    # root is the directory the records' files are relative to, see algo.TileSet.tile_directory_of
     result = copy.deepcopy(elem)
     
-    result["file"] = rotate_image_file(result["file"], direct, outdir)
+    result["file"] = os.path.relpath(rotated_filename(result["file"], direct, outdir), root or os.curdir)
     result["bordermask"] = rotate_border_mask(result["bordermask"], direct)
     result["edgemask"] = rotate_edge_mask(result["edgemask"], direct)
     result["sflg"] = rotate_sflgs(result["sflg"], direct)
+    if "count" in elem:
+        # still the same physical tile, so it shares the original's count
+        result["piece"] = elem.get("piece", elem["file"])
 
     return result
 
@@ -93,6 +126,8 @@ if __name__ == "__main__":
     parser.add_argument("FILE", type=str, help="json tile set")
     parser.add_argument("--test", action="store_true", help="dry run, just run tests")
     parser.add_argument("--outdir", type=str, default="rotated_tiles", help="Output directory.  Default is 'rotated_tiles'")
+    parser.add_argument("--jobs", type=int, default=None, help="Worker processes.  Default is one per core")
+    parser.add_argument("--force", action="store_true", help="Rewrite every rotation, even for tiles the manifest says are unchanged")
 
     args = parser.parse_args()
 
@@ -102,14 +137,30 @@ if __name__ == "__main__":
 
     obj = read_json(args.FILE)
     tile_list = obj["tile_list"]
+    # the modded .json goes next to this one, so its files are relative to the same place
+    root = algo.TileSet.tile_directory_of(args.FILE, obj)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    manifest = {} if args.force else read_manifest(args.outdir)
+
+    # don't rotate all ocean tiles, since they don't look as good
+    to_rotate = [elem for elem in tile_list if elem["edgemask"] != "0000"]
+
+    # the images are the expensive part, so farm those out, each source once
+    sources = list(dict.fromkeys(elem["file"] for elem in to_rotate))
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(rotate_if_changed, os.path.join(root, src), args.outdir, manifest.get(src, {}).get("hash")) for src in sources]
+        outcomes = dict(zip(sources, (f.result() for f in futures)))
 
     rotated_results = []
-    for elem in tile_list:
-        # don't rotate all ocean tiles, since they don't look as good
-        if elem["edgemask"] == "0000":
-            continue
-        for direction in [Rot.CW, Rot.CCW, Rot.FULL180]:
-            rotated_results.append(rotate_tile(elem, direction, args.outdir))
+    for elem in to_rotate:
+        for direction in ALL_ROTATIONS:
+            rotated_results.append(rotate_tile(elem, direction, args.outdir, root))
+        manifest[elem["file"]] = {"hash": outcomes[elem["file"]][0]}
+    write_manifest(args.outdir, manifest)
+
+    written = sum(1 for _, changed in outcomes.values() if changed)
+    print(f"rotated {written} of {len(sources)} tile images ({len(sources) - written} unchanged)")
     
     obj["tile_list"] += rotated_results
 